@@ -1,43 +1,79 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+import gzip
+import hashlib
 import sys
 import os
 import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+import fund_env
+# 服务入口先加载 .env，再导入在导入时读取环境变量配置的项目模块
+fund_env.load_environment()
+import fund_async
+import fund_cache
+import fund_models
+import fund_store
 import fund_tracker
+import http_client
+import metrics
+import vika_sync
 import json
 
+try:
+    import brotli  # 可选依赖，未安装时只使用 gzip
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
-# 用户数据文件映射
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-USER_DATA_FILES = {
-    'user1': os.path.join(DATA_DIR, 'funds.json'),
-    'user2': os.path.join(DATA_DIR, 'funds_user2.json'),
-}
+# 用户数据文件映射（与静态快照导出共用 fund_tracker 中的定义）
+USER_DATA_FILES = fund_tracker.USER_DATA_FILES
 DEFAULT_USER = 'user1'
 
+# 自动同步维格表的最小间隔（秒）
+VIKA_SYNC_INTERVAL = float(os.environ.get("VIKA_SYNC_INTERVAL", "30"))
+
+# 后台定时估值快照（SNAPSHOT_SCHEDULER=1 开启）
+SNAPSHOT_SCHEDULER = os.environ.get("SNAPSHOT_SCHEDULER", "0") == "1"
+# 盘中刷新间隔（秒）
+SNAPSHOT_TRADING_INTERVAL = float(os.environ.get("SNAPSHOT_TRADING_INTERVAL", "60"))
+# 休市时刷新间隔上限（秒），不会晚于下一次开盘
+SNAPSHOT_IDLE_INTERVAL = float(os.environ.get("SNAPSHOT_IDLE_INTERVAL", "1800"))
+
+# /api/estimates?sort= 支持的数值排序字段
+SORT_FIELDS = ('change_pct', 'change_amount', 'estimate_nav', 'latest_nav')
+
+# 估值响应的浏览器缓存时间上限（秒）：实际取到下一次估值更新（盘中下一分钟 / 下一次开盘）为止，不超过该值
+API_MAX_AGE = float(os.environ.get("API_MAX_AGE", "300"))
+# 响应体不小于该字节数时按 Accept-Encoding 压缩
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+COMPRESS_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
 def get_user(req=None):
-    """从请求参数中获取用户标识，默认为 user1"""
+    """从请求参数中获取用户标识；缺省或未知用户归为 DEFAULT_USER（快照、刷新只针对已配置的用户）"""
     if req is None:
         req = request
-    return req.args.get('user', DEFAULT_USER)
+    user = req.args.get('user', DEFAULT_USER)
+    return user if user in USER_DATA_FILES else DEFAULT_USER
 
-def load_funds_for_user(user):
-    """加载指定用户的基金列表"""
+def get_store_for_user(user):
+    """指定用户的基金存储（带索引和文件锁）"""
     data_file = USER_DATA_FILES.get(user, USER_DATA_FILES[DEFAULT_USER])
-    return fund_tracker.load_funds(data_file)
+    return fund_store.get_store(data_file)
 
-def save_funds_for_user(user, funds):
-    """保存指定用户的基金列表"""
-    data_file = USER_DATA_FILES.get(user, USER_DATA_FILES[DEFAULT_USER])
-    return fund_tracker.save_funds(funds, data_file)
+def load_funds_for_user(user):
+    """加载指定用户的基金列表"""
+    return get_store_for_user(user).list()
 
 def _sync_vika_background(results):
-    """后台线程：同步数据到维格表"""
-    try:
-        print("🔄 [后台] 正在自动同步 user1 数据到维格表...")
-        fund_tracker.update_vika_table(results)
-    except Exception as e:
-        print(f"⚠️  [后台] 维格表同步失败: {e}")
+    """后台同步任务：同步数据到维格表（失败抛出异常，由 vika_worker 记录）"""
+    print("🔄 [后台] 正在自动同步 user1 数据到维格表...")
+    return fund_tracker.update_vika_table(results, raise_errors=True)
+
+# 常驻同步线程：合并连续刷新，只同步最新一份快照
+vika_worker = vika_sync.SyncWorker(_sync_vika_background, interval=VIKA_SYNC_INTERVAL)
 
 def _refresh_risk_levels_background(data_file):
     """后台线程：批量补全所有基金风险评级"""
@@ -47,6 +83,73 @@ def _refresh_risk_levels_background(data_file):
     except Exception as e:
         print(f"⚠️  [后台] 批量更新风险评级失败: {e}")
 
+@app.before_request
+def _start_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def _record_timing(response):
+    """
+    按路由模板（而非具体 URL）记录接口耗时
+    流式响应（SSE）在视图返回时还没开始推送，改为在响应关闭（推送结束或客户端断开）时记录
+    """
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = {'route': route, 'method': request.method, 'status': response.status_code}
+
+        def observe():
+            metrics.HTTP_LATENCY.observe(time.monotonic() - started, **labels)
+
+        if response.is_streamed:
+            response.call_on_close(observe)
+        else:
+            observe()
+    return response
+
+@app.after_request
+def _compress(response):
+    """按 Accept-Encoding 压缩较大的响应（优先 br，未安装 brotli 时只用 gzip）；流式响应不压缩"""
+    if (response.mimetype not in COMPRESS_MIMETYPES or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(data, quality=min(COMPRESS_LEVEL, 11)))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def _conditional_json(payload, max_age=0):
+    """
+    JSON 响应带内容哈希 ETag（弱校验，压缩前后通用），If-None-Match 命中时返回 304（不带响应体）
+    max_age > 0 时浏览器可在该时间内直接复用，否则每次都带 If-None-Match 重新验证
+    """
+    response = jsonify(payload)
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest(), weak=True)
+    if max_age > 0:
+        response.cache_control.private = True
+        response.cache_control.max_age = int(max_age)
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def _estimates_max_age():
+    """距下一次估值更新的秒数（不超过 API_MAX_AGE）"""
+    now = fund_cache.market_now()
+    return min(API_MAX_AGE, (fund_cache.next_tick(now) - now).total_seconds())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -55,26 +158,23 @@ def index():
 def get_funds():
     user = get_user()
     funds = load_funds_for_user(user)
-    return jsonify(funds)
+    # 基金列表随用户增删变化，每次重新验证（未变化时 304）
+    return _conditional_json(funds)
 
 @app.route('/api/funds', methods=['POST'])
 def add_fund():
     user = get_user()
     data = request.json
-    funds = load_funds_for_user(user)
+    store = get_store_for_user(user)
     
-    # Check if duplicate
-    for f in funds:
-        if f['code'] == data['code']:
-            return jsonify({'success': False, 'message': '基金已存在'}), 400
+    # 查重和写入在存储锁内完成
+    if not store.add(data):
+        return jsonify({'success': False, 'message': '基金已存在'}), 400
             
-    funds.append(data)
-    save_funds_for_user(user, funds)
-    if user == DEFAULT_USER:
-        fund_tracker.FUNDS = funds
+    request_snapshot_refresh()
 
     # 后台更新该用户所有基金的风险评级（补全缺失项）
-    data_file = USER_DATA_FILES.get(user, USER_DATA_FILES[DEFAULT_USER])
+    data_file = USER_DATA_FILES[user]
     t = threading.Thread(target=_refresh_risk_levels_background, args=(data_file,), daemon=True)
     t.start()
 
@@ -83,59 +183,220 @@ def add_fund():
 @app.route('/api/funds/<string:code>', methods=['DELETE'])
 def delete_fund(code):
     user = get_user()
-    funds = load_funds_for_user(user)
-    new_funds = [f for f in funds if f['code'] != code]
-    save_funds_for_user(user, new_funds)
-    if user == DEFAULT_USER:
-        fund_tracker.FUNDS = new_funds
+    store = get_store_for_user(user)
+    store.delete(code)
+    request_snapshot_refresh()
     return jsonify({'success': True})
 
+def _estimate_rows(funds, results):
+    """估值结果（与 funds 顺序一致）序列化为响应行"""
+    return [fund_models.result_row(fund, res) for fund, res in zip(funds, results)]
+
+def _sort_results(funds, results, field, descending=False):
+    """按估值数值字段排序，失败的基金排在最后"""
+    ok = [(f, r) for f, r in zip(funds, results) if isinstance(r, fund_models.FundEstimate)]
+    failed = [(f, r) for f, r in zip(funds, results) if not isinstance(r, fund_models.FundEstimate)]
+    ok.sort(key=lambda pair: getattr(pair[1], field), reverse=descending)
+    pairs = ok + failed
+    return [f for f, _ in pairs], [r for _, r in pairs]
+
+# ─── 估值快照 ──────────────────────────────────────────────
+# 快照发布后不再修改，整体替换引用：{user: (as_of, {code: FundEstimate | None | 异常})}
+_snapshot = MappingProxyType({})
+_snapshot_lock = threading.Lock()
+_snapshot_wakeup = threading.Event()
+_snapshot_thread = None
+
+def _publish_snapshot(user_results, as_of):
+    """发布新快照（仅替换给定用户的数据）user_results: {user: (funds, results)}"""
+    global _snapshot
+    with _snapshot_lock:
+        users = dict(_snapshot)
+        for user, (funds, results) in user_results.items():
+            by_code = {fund['code']: res for fund, res in zip(funds, results)}
+            users[user] = (as_of, MappingProxyType(by_code))
+        _snapshot = MappingProxyType(users)
+
+def refresh_snapshot():
+    """刷新所有用户基金的并集并发布快照"""
+    user_funds = {user: load_funds_for_user(user) for user in USER_DATA_FILES}
+    as_of = datetime.now().isoformat(timespec='seconds')
+    # 跨用户去重：相同基金只估值一次，再按用户套用各自的来源/风险评级
+    estimates = fund_tracker.calculate_user_estimates(user_funds, return_exceptions=True)
+    _publish_snapshot({user: (funds, estimates[user]) for user, funds in user_funds.items()}, as_of)
+    print(f"📸 估值快照已更新 ({as_of}，共 {sum(len(f) for f in user_funds.values())} 个基金)")
+
+    if user_funds.get('user1'):
+        vika_worker.submit(_estimate_rows(user_funds['user1'], estimates['user1']))
+    return as_of
+
+def _snapshot_interval():
+    """盘中按固定间隔刷新；休市时放慢，但不晚于下一次开盘"""
+    now = fund_cache.market_now()
+    if fund_cache.is_trading_time(now):
+        return SNAPSHOT_TRADING_INTERVAL
+    until_open = (fund_cache.next_market_open(now) - now).total_seconds()
+    return max(SNAPSHOT_TRADING_INTERVAL, min(SNAPSHOT_IDLE_INTERVAL, until_open))
+
+def _snapshot_loop():
+    while True:
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            print(f"⚠️  [后台] 估值快照刷新失败: {e}")
+        _snapshot_wakeup.wait(_snapshot_interval())
+        _snapshot_wakeup.clear()
+
+def start_snapshot_scheduler():
+    """启动后台快照刷新线程（重复调用无副作用）"""
+    global _snapshot_thread
+    with _snapshot_lock:
+        if _snapshot_thread is None or not _snapshot_thread.is_alive():
+            _snapshot_thread = threading.Thread(target=_snapshot_loop, name="snapshot-scheduler", daemon=True)
+            _snapshot_thread.start()
+
+def request_snapshot_refresh():
+    """基金列表变化时让后台线程立即刷新"""
+    if _snapshot_thread is not None:
+        _snapshot_wakeup.set()
+
+def get_snapshot_results(user, funds):
+    """
+    从快照中取出该用户当前基金列表对应的估值结果
+    快照缺少其中任何基金（如刚添加）时返回 (None, None)
+    """
+    entry = _snapshot.get(user)
+    if entry is None:
+        return None, None
+    as_of, by_code = entry
+    if any(fund['code'] not in by_code for fund in funds):
+        return None, None
+    return as_of, [by_code[fund['code']] for fund in funds]
+
 @app.route('/api/estimates', methods=['GET'])
-def get_estimates():
+async def get_estimates():
+    """
+    估值列表
+    ?fresh=1 跳过快照实时估值；?sort=change_pct&order=desc 按数值字段排序（失败的基金排在最后）
+    响应带内容 ETag，内容未变化时对 If-None-Match 返回 304；Cache-Control 有效期到下一次估值更新
+    """
     user = get_user()
     funds = load_funds_for_user(user)
-    results = []
-    
-    for fund in funds:
-        try:
-            res = fund_tracker.calculate_fund_estimate(fund)
-            if res:
-                results.append(res)
-            else:
-                results.append({
-                    "基金名称": fund.get('name', fund['code']),
-                    "基金代码": fund['code'],
-                    "当前估值": "获取失败",
-                    "涨跌幅": "0",
-                    "风险评级": fund.get('risk_level', ''),
-                    "error": True
-                })
-        except Exception as e:
-            results.append({
-                "基金名称": fund.get('name', fund['code']),
-                "基金代码": fund['code'],
-                "当前估值": "出错",
-                "涨跌幅": "0",
-                "风险评级": fund.get('risk_level', ''),
-                "error": str(e)
-            })
-
-    # user1 每次刷新自动同步到维格表（后台线程，不阻塞响应）
-    if user == 'user1' and results:
-        t = threading.Thread(target=_sync_vika_background, args=(results,), daemon=True)
-        t.start()
-
-    return jsonify(results)
+    fresh = request.args.get('fresh') == '1'
+    sort = request.args.get('sort')
+    if sort and sort not in SORT_FIELDS:
+        return jsonify({'success': False, 'message': f"不支持的排序字段，可选: {', '.join(SORT_FIELDS)}"}), 400
+
+    # 快照模式：直接返回后台刷新好的快照
+    results = None
+    if SNAPSHOT_SCHEDULER and not fresh:
+        as_of, results = get_snapshot_results(user, funds)
+        source = 'snapshot'
+        if results is None:
+            request_snapshot_refresh()
+
+    if results is None:
+        source = 'live'
+        as_of = datetime.now().isoformat(timespec='seconds')
+        async with fund_async.session():
+            results = await fund_async.calculate_fund_estimates(funds, return_exceptions=True)
+        if SNAPSHOT_SCHEDULER:
+            _publish_snapshot({user: (funds, results)}, as_of)
+
+        # user1 每次刷新自动同步到维格表（交给后台同步线程，不阻塞响应）
+        if user == 'user1' and funds:
+            vika_worker.submit(_estimate_rows(funds, results))
+
+    if sort:
+        funds, results = _sort_results(funds, results, sort, request.args.get('order') == 'desc')
+    response = _conditional_json(_estimate_rows(funds, results), _estimates_max_age())
+    response.headers['X-Estimates-As-Of'] = as_of
+    response.headers['X-Estimates-Source'] = source
+    return response
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/estimates/stream', methods=['GET'])
+def stream_estimates():
+    """
+    流式估值（Server-Sent Events）
+    每个基金完成后立即推送 fund 事件 {index, row}，全部结束后推送 summary 事件
+    快照模式下按顺序推送快照中的结果；?fresh=1 或快照缺少该用户的基金时实时估值
+    """
+    user = get_user()
+    funds = load_funds_for_user(user)
+    fresh = request.args.get('fresh') == '1'
+
+    snapshot_as_of, snapshot_results = None, None
+    if SNAPSHOT_SCHEDULER and not fresh:
+        snapshot_as_of, snapshot_results = get_snapshot_results(user, funds)
+        if snapshot_results is None:
+            request_snapshot_refresh()
+
+    def generate():
+        started = time.monotonic()
+        if snapshot_results is not None:
+            source, as_of = 'snapshot', snapshot_as_of
+            estimates = ((i, fund, res) for i, (fund, res) in enumerate(zip(funds, snapshot_results)))
+        else:
+            source, as_of = 'live', datetime.now().isoformat(timespec='seconds')
+            estimates = fund_tracker.iter_fund_estimates(funds)
+        results = [None] * len(funds)
+        rows = [None] * len(funds)
+        failed = 0
+        for i, fund, res in estimates:
+            row = fund_models.result_row(fund, res)
+            results[i] = res
+            rows[i] = row
+            if row.get('error'):
+                failed += 1
+            yield _sse('fund', {'index': i, 'row': row})
+
+        if source == 'live':
+            if SNAPSHOT_SCHEDULER:
+                _publish_snapshot({user: (funds, results)}, as_of)
+            if user == 'user1' and rows:
+                vika_worker.submit(rows)
+        yield _sse('summary', {
+            'count': len(rows),
+            'failed': failed,
+            'as_of': as_of,
+            'source': source,
+            'elapsed': round(time.monotonic() - started, 3),
+        })
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/portfolio', methods=['GET'])
+def get_portfolio():
+    """持仓组合汇总：市值、今日盈亏、权重，以及按来源/类型/风险评级的汇总"""
+    import portfolio
+
+    user = get_user()
+    funds = load_funds_for_user(user)
+    as_of, results = get_snapshot_results(user, funds) if SNAPSHOT_SCHEDULER else (None, None)
+    if results is None:
+        as_of = datetime.now().isoformat(timespec='seconds')
+        results = fund_tracker.calculate_fund_estimates(funds, return_exceptions=True)
+
+    summary = portfolio.summarize(funds, results)
+    summary['as_of'] = as_of
+    return jsonify(summary)
 
 @app.route('/api/fund_info/<string:code>', methods=['GET'])
 def get_fund_info(code):
     info = fund_tracker.get_fund_realtime_data(code)
     if info['success']:
-        # 尝试获取风险评级
+        # 风险评级和类型优先读元数据缓存
         risk_level = fund_tracker.get_fund_risk_level(code)
+        meta = fund_tracker.fund_meta.get_meta(code)
         return jsonify({
             'fund_name': info['fund_name'],
-            'type': 'active',
+            'type': meta.get('type', 'active'),
             'risk_level': risk_level or '',
             'success': True
         })
@@ -146,31 +407,46 @@ def get_fund_info(code):
 def update_risk_levels():
     """手动触发：批量补全当前用户所有基金的风险评级"""
     user = get_user()
-    data_file = USER_DATA_FILES.get(user, USER_DATA_FILES[DEFAULT_USER])
+    data_file = USER_DATA_FILES[user]
     try:
         updated = fund_tracker.batch_update_risk_levels(data_file)
         return jsonify({'success': True, 'updated': updated})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/sync_status', methods=['GET'])
+def sync_status():
+    """后台维格表同步状态"""
+    return jsonify(vika_worker.status())
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """估值缓存命中统计"""
+    return jsonify(fund_tracker.estimate_cache.stats())
+
+@app.route('/api/upstreams', methods=['GET'])
+def upstream_status():
+    """各上游熔断器状态：state / health / 窗口内请求数、失败率、延迟"""
+    return jsonify(http_client.breaker_states())
+
 @app.route('/api/sync', methods=['POST'])
-def sync_vika():
+async def sync_vika():
     user = get_user()
     funds = load_funds_for_user(user)
-    results = []
-    for fund in funds:
-        res = fund_tracker.calculate_fund_estimate(fund)
-        if res:
-            results.append(res)
-            
+    async with fund_async.session():
+        results = [r for r in await fund_async.calculate_fund_estimates(funds) if r]
+
     if not results:
         return jsonify({'success': False, 'message': '无数据可同步'})
         
-    success = fund_tracker.update_vika_table(results)
+    success = await fund_async.update_vika_table(results)
     if success:
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'message': '同步失败，请检查日志'})
 
+if SNAPSHOT_SCHEDULER:
+    start_snapshot_scheduler()
+
 if __name__ == '__main__':
     app.run(debug=True, port=8888)
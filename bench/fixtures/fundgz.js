@@ -0,0 +1 @@
+jsonpgz({"fundcode":"$code","name":"$name","jzrq":"$nav_date","dwjz":"$nav","gsz":"$gsz","gszzl":"$gszzl","gztime":"$gztime"});
\ No newline at end of file
@@ -0,0 +1 @@
+var apidata={ content:"<div class='box'><div class='boxitem w790'><h4 class='t'><label class='left'><a href='http://fund.eastmoney.com/$code.html'>$name</a>&nbsp;&nbsp;$period_name股票投资明细</label><label class='right lab2 xq505'>&nbsp;&nbsp;&nbsp;&nbsp;来源：<a href='#'>天天基金</a>&nbsp;&nbsp;&nbsp;&nbsp;截止至：<font class='px12'>$report_date</font></label></h4><div class='space0'></div><table class='w782 comm tzxq'><thead><tr><th class='first'>序号</th><th>股票代码</th><th>股票名称</th><th>最新价</th><th>涨跌幅</th><th class='xglj'>相关资讯</th><th>占净值<br />比例</th><th class='cgs'>持股数<br />（万股）</th><th class='last ccs'>持仓市值<br />（万元）</th></tr></thead><tbody>$rows</tbody></table></div></div>",arryear:[$year],curyear:$year};
\ No newline at end of file
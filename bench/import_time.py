@@ -0,0 +1,107 @@
+"""
+导入耗时守护
+在子进程中用 python -X importtime 导入模块（默认 fund_tracker），检查：
+- 累计导入耗时（多次运行取中位数）不超过预算
+- 不导入重依赖（pandas / numpy / dotenv / asyncio / flask，只应在用到的路径上按需导入）
+- 导入期间不打开项目目录下的任何数据文件（.py / .pyc 除外）
+超出预算或违反约束时退出码为 1，可直接用于 CI / 定时任务前的检查
+
+用法: python bench/import_time.py [--module fund_tracker] [--runs 5] [--budget-ms 300] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_FORBIDDEN = ('pandas', 'numpy', 'dotenv', 'asyncio', 'flask')
+DEFAULT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "300"))
+
+# 子进程中执行：记录打开的文件，导入模块后输出已加载模块和打开的项目文件
+PROBE = """
+import json, os, sys
+root = {root!r}
+opened = []
+def hook(event, args):
+    if event == 'open' and isinstance(args[0], str):
+        path = os.path.abspath(args[0])
+        if path.startswith(root + os.sep) and not path.endswith(('.py', '.pyc')) and '__pycache__' not in path:
+            opened.append(os.path.relpath(path, root))
+sys.addaudithook(hook)
+import {module}
+print(json.dumps({{'modules': sorted(sys.modules), 'opened': opened}}))
+"""
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块, 自身耗时 us, 累计耗时 us, 层级)]，层级 0 为被检查的模块本身"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def run_once(module):
+    """一次冷启动导入，返回 (累计耗时 ms, importtime 明细, 探针结果)"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(root=ROOT_DIR, module=module)],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+    rows = parse_importtime(proc.stderr)
+    total = next((cumulative for name, _self, cumulative, _depth in rows if name == module), None)
+    if total is None:
+        raise RuntimeError(f"importtime 输出中没有 {module}")
+    return total / 1000, rows, json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模块导入耗时守护（python -X importtime）")
+    parser.add_argument('--module', default='fund_tracker', help="要检查的模块")
+    parser.add_argument('--runs', type=int, default=5, help="运行次数（取中位数）")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help="累计导入耗时预算（毫秒，默认取 IMPORT_BUDGET_MS 或 300）")
+    parser.add_argument('--forbid', default=','.join(DEFAULT_FORBIDDEN), help="导入时不允许加载的模块，逗号分隔")
+    parser.add_argument('--top', type=int, default=10, help="显示累计耗时最多的依赖数量")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(max(1, args.runs)):
+        total_ms, rows, probe = run_once(args.module)
+        timings.append(total_ms)
+    median = statistics.median(timings)
+
+    print(f"⏱️  import {args.module}: 中位数 {median:.1f}ms（{len(timings)} 次: "
+          f"{', '.join(f'{t:.1f}' for t in timings)}），预算 {args.budget_ms:.0f}ms")
+    # 直接依赖按累计耗时排序
+    direct = sorted((r for r in rows if r[3] == 1), key=lambda r: r[2], reverse=True)[:args.top]
+    for name, _self, cumulative, _depth in direct:
+        print(f"   {cumulative / 1000:8.1f}ms  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"导入耗时 {median:.1f}ms 超出预算 {args.budget_ms:.0f}ms")
+    forbidden = [m for m in args.forbid.split(',') if m.strip() and m.strip() in probe['modules']]
+    if forbidden:
+        failures.append(f"导入时加载了重依赖: {', '.join(forbidden)}")
+    if probe['opened']:
+        failures.append(f"导入时读取了项目文件: {', '.join(sorted(set(probe['opened'])))}")
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ 导入无 I/O，未加载重依赖，耗时在预算内")
+
+
+if __name__ == "__main__":
+    main()
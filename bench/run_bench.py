@@ -0,0 +1,255 @@
+"""
+离线基准测试
+启动本地桩服务器（bench/stub_server.py），把所有上游指向它，分别测量：
+- estimate:   calculate_fund_estimates 批量估值（每只基金 calculate_fund_estimate 的耗时）
+- api:        GET /api/estimates（冷缓存 / 热缓存）
+- vika:       update_vika_table 全量新增 / 无变化 / 全部更新
+规模默认 10/100/1000 只基金，输出吞吐量与 p50/p99
+
+用法: python bench/run_bench.py [--sizes 10,100,1000] [--rounds 3] [--scenarios estimate,api,vika]
+                               [--latency 0.02] [--error-rate 0.01] [--fault fundgz.error_rate=1] [--json out.json]
+所有状态文件写入临时目录，不会修改 data/
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import add_fault_arguments, server_from_args  # noqa: E402
+
+SCENARIOS = ('estimate', 'api', 'vika')
+DATASHEET_ID = 'dstBenchmark'
+
+
+def percentile(values, pct):
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def make_funds(count):
+    """生成基金列表：ETF联接 40%、主动型 40%（带 index_code）、债券型 20%"""
+    etf_codes = ('510300', '159915', '512480', '512400', '159934', '588000')
+    index_codes = ('000300', '399006', '000905', '000832')
+    funds = []
+    for i in range(count):
+        code = f"{100000 + i:06d}"
+        kind = i % 5
+        fund = {'code': code, 'name': f"基准测试基金{code}", 'source': '基准测试'}
+        if i % 3:
+            fund['risk_level'] = 'R3 中等风险'  # 其余基金走风险评级缓存 / F10 页面
+        if kind in (0, 1):
+            etf = etf_codes[i % len(etf_codes)]
+            fund.update(type='etf_linked', etf_code=etf, etf_name=f"ETF{etf}")
+        elif kind in (2, 3):
+            fund.update(type='active', index_code=index_codes[i % len(index_codes)])
+        else:
+            fund.update(type='bond')
+        funds.append(fund)
+    return funds
+
+
+def _result(scenario, size, latencies, elapsed, units, errors=0):
+    return {
+        'scenario': scenario,
+        'funds': size,
+        'calls': len(latencies),
+        'throughput': round(units / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+    }
+
+
+def _reset_caches(modules):
+    modules['fund_tracker'].estimate_cache.invalidate()
+    modules['http_client'].reset_breakers()
+
+
+def bench_estimate(modules, funds, rounds):
+    """批量估值：吞吐量按 基金数/批次耗时，延迟为单只基金 calculate_fund_estimate 耗时"""
+    fund_tracker = modules['fund_tracker']
+    original = fund_tracker.calculate_fund_estimate
+    latencies = []
+
+    def timed(fund, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(fund, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    errors = 0
+    elapsed = 0.0
+    fund_tracker.calculate_fund_estimate = timed
+    try:
+        for _ in range(rounds):
+            _reset_caches(modules)
+            started = time.perf_counter()
+            results = fund_tracker.calculate_fund_estimates(funds, return_exceptions=True)
+            elapsed += time.perf_counter() - started
+            errors += sum(1 for r in results if r is None or isinstance(r, Exception))
+    finally:
+        fund_tracker.calculate_fund_estimate = original
+    return [_result('estimate', len(funds), latencies, elapsed, len(funds) * rounds, errors)]
+
+
+def bench_api(modules, funds, rounds, workdir):
+    """GET /api/estimates：冷缓存（每轮清空）与热缓存，吞吐量单位为 基金/秒"""
+    app = modules['app']
+    data_file = os.path.join(workdir, f"funds_{len(funds)}.json")
+    with open(data_file, 'w', encoding='utf-8') as f:
+        json.dump(funds, f, ensure_ascii=False)
+    # 使用 user2，避免触发 user1 的维格表后台同步
+    app.USER_DATA_FILES['user2'] = data_file
+    client = app.app.test_client()
+
+    results = []
+    for label, cold in (('api-cold', True), ('api-warm', False)):
+        latencies = []
+        errors = 0
+        _reset_caches(modules)
+        if not cold:
+            client.get('/api/estimates?user=user2')  # 预热
+        for _ in range(rounds):
+            if cold:
+                _reset_caches(modules)
+            started = time.perf_counter()
+            response = client.get('/api/estimates?user=user2')
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+            else:
+                errors += sum(1 for row in response.get_json() if row.get('error'))
+        results.append(_result(label, len(funds), latencies, sum(latencies), len(funds) * rounds, errors))
+    return results
+
+
+def bench_vika(modules, funds, rounds, server):
+    """update_vika_table：全量新增、无变化、全部更新，吞吐量单位为 记录/秒"""
+    fund_tracker = modules['fund_tracker']
+    vika_sync = modules['vika_sync']
+    fund_models = modules['fund_models']
+    _reset_caches(modules)
+    estimates = [r for r in fund_tracker.calculate_fund_estimates(funds) if r]
+    rows = [fund_models.to_row(r) for r in estimates]
+    changed = [{**row, '当前估值': f"{float(row['当前估值']) + 0.0001:.4f}"} for row in rows]
+
+    phases = {'vika-create': [], 'vika-noop': [], 'vika-update': []}
+    failures = dict.fromkeys(phases, 0)
+    for _ in range(rounds):
+        server.stub.vika_records.clear()
+        vika_sync.reset_state()
+        for phase, records in (('vika-create', rows), ('vika-noop', rows), ('vika-update', changed)):
+            started = time.perf_counter()
+            ok = fund_tracker.update_vika_table(records)
+            phases[phase].append(time.perf_counter() - started)
+            failures[phase] += 0 if ok else 1
+    return [_result(phase, len(funds), latencies, sum(latencies), len(rows) * len(latencies), failures[phase])
+            for phase, latencies in phases.items()]
+
+
+def _setup(args, workdir):
+    """启动桩服务器并在导入项目模块前设置环境变量"""
+    server = server_from_args(args).start()
+    os.environ.update(server.upstream_env())
+    os.environ.update({
+        'FUND_META_FILE': os.path.join(workdir, 'fund_meta.json'),
+        'FUND_HOLDINGS_FILE': os.path.join(workdir, 'fund_holdings.json'),
+        'FUND_HISTORY_DB': os.path.join(workdir, 'history.db'),
+        'VIKA_STATE_FILE': os.path.join(workdir, 'vika_state.json'),
+        'SOURCE_RANKING_FILE': os.path.join(workdir, 'source_ranking.json'),
+        'FUND_STORE_BACKEND': 'json',
+        'SNAPSHOT_SCHEDULER': '0',
+        'VIKA_API_TOKEN': 'benchmark',
+        'VIKA_DATASHEET_ID': DATASHEET_ID,
+    })
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        import fund_models
+        import fund_tracker
+        import http_client
+        import vika_sync
+    # 基准测试关注自身开销，维格表限流默认放开（--vika-qps 可恢复真实配额）
+    vika_sync.rate_limiter = vika_sync.TokenBucket(args.vika_qps)
+    if args.client_timeout:
+        for name in http_client.UPSTREAMS:
+            http_client.configure_upstream(name, timeout=args.client_timeout)
+    modules = {'app': app, 'fund_models': fund_models, 'fund_tracker': fund_tracker,
+               'http_client': http_client, 'vika_sync': vika_sync}
+    return server, modules
+
+
+def print_table(results):
+    columns = ('scenario', 'funds', 'calls', 'throughput', 'p50_ms', 'p99_ms', 'errors', 'elapsed_s')
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试（本地桩服务器）")
+    parser.add_argument('--sizes', default='10,100,1000', help="基金数量，逗号分隔")
+    parser.add_argument('--rounds', type=int, default=3, help="每个场景重复次数")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"可选: {','.join(SCENARIOS)}")
+    parser.add_argument('--vika-qps', type=float, default=1000.0, help="维格表限流 QPS（默认放开）")
+    parser.add_argument('--client-timeout', type=float, default=None, help="覆盖所有上游的客户端超时（秒）")
+    parser.add_argument('--json', help="结果另存为 JSON 文件")
+    parser.add_argument('--verbose', action='store_true', help="显示项目代码的日志输出")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix='fund-bench-') as workdir:
+        server, modules = _setup(args, workdir)
+        print(f"🧪 桩服务器: {server.url}  规模: {sizes}  轮数: {args.rounds}")
+        results = []
+        try:
+            for size in sizes:
+                funds = make_funds(size)
+                for scenario in scenarios:
+                    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                    with output:
+                        if scenario == 'estimate':
+                            rows = bench_estimate(modules, funds, args.rounds)
+                        elif scenario == 'api':
+                            rows = bench_api(modules, funds, args.rounds, workdir)
+                        else:
+                            rows = bench_vika(modules, funds, args.rounds, server)
+                    results.extend(rows)
+                    for row in rows:
+                        print(f"   ✅ {row['scenario']} × {size}: {row['throughput']}/s  "
+                              f"p50 {row['p50_ms']}ms  p99 {row['p99_ms']}ms")
+        finally:
+            server.stop()
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k != 'fault'}, 'results': results},
+                      f, ensure_ascii=False, indent=1)
+        print(f"📄 结果已保存: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+本地上游桩服务器（离线基准测试用）
+用 bench/fixtures 中录制的响应模板回放：
+- fundgz:  /js/<code>.js                      天天基金 jsonpgz
+- fundmob: /FundMNewApi/FundMNFInfo?Fcodes=   天天基金移动端多基金估值
+- push2:   /api/qt/stock/get, /api/qt/ulist.np/get   东方财富行情
+- f10:     /f10/tsdata_<code>.html, /FundArchivesDatas.aspx   风险评级页、持仓明细
+- vika:    /datasheets/<dst>/records           维格表记录（内存中增删改查）
+支持按上游注入延迟、错误（503）和超时（挂起 hang 秒后才响应）
+
+用法: python bench/stub_server.py [--port 8765] [--latency 0.02] [--error-rate 0.01] [--fault fundgz.error_rate=1]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 可注入的故障参数
+FAULT_FIELDS = ('latency', 'jitter', 'error_rate', 'timeout_rate', 'hang')
+
+# 伪造持仓使用的股票池 (secid, 名称)
+STOCK_POOL = (
+    ('1.600519', '贵州茅台'), ('0.300750', '宁德时代'), ('1.601318', '中国平安'), ('0.000858', '五粮液'),
+    ('1.600036', '招商银行'), ('0.002594', '比亚迪'), ('1.688981', '中芯国际'), ('0.000333', '美的集团'),
+    ('1.601899', '紫金矿业'), ('0.300308', '中际旭创'), ('1.600900', '长江电力'), ('0.002475', '立讯精密'),
+    ('116.00700', '腾讯控股'), ('1.603259', '药明康德'), ('0.300059', '东方财富'), ('1.601012', '隆基绿能'),
+)
+
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return Template(f.read())
+
+
+def _seed(*parts):
+    """由代码得到稳定的伪随机数（同一代码每次回放的数据一致）"""
+    digest = hashlib.md5(":".join(str(p) for p in parts).encode()).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF
+
+
+class StubUpstreams:
+    """桩服务器的数据与故障配置（处理线程共享）"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0, hang=15.0,
+                 no_estimate_rate=0.05, nav_date='2026-01-05', gztime='2026-01-06 14:30', seed=0):
+        self.defaults = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                         'timeout_rate': timeout_rate, 'hang': hang}
+        self.faults = {}               # upstream -> {field: value}，覆盖默认值
+        self.no_estimate_rate = no_estimate_rate
+        self.nav_date = nav_date
+        self.gztime = gztime
+        self.requests = {}             # upstream -> 请求数
+        self.vika_records = {}         # recordId -> fields
+        self._next_record = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.templates = {name: _load_fixture(name) for name in (
+            'fundgz.js', 'fundmob.json', 'fundmob_item.json', 'push2_stock.json', 'push2_ulist.json', 'push2_ulist_item.json',
+            'tsdata.html', 'jjcc.js', 'jjcc_row.html',
+        )}
+
+    # ─── 故障注入 ─────────────────────────────────────────
+    def set_fault(self, upstream, **fields):
+        unknown = set(fields) - set(FAULT_FIELDS)
+        if unknown:
+            raise KeyError(f"未知的故障参数: {', '.join(sorted(unknown))}")
+        with self._lock:
+            self.faults.setdefault(upstream, {}).update(fields)
+
+    def clear_faults(self):
+        with self._lock:
+            self.faults.clear()
+
+    def _fault(self, upstream):
+        return {**self.defaults, **self.faults.get(upstream, {})}
+
+    def inject(self, upstream):
+        """按配置休眠；返回 'error' / 'timeout' / None"""
+        fault = self._fault(upstream)
+        with self._lock:
+            self.requests[upstream] = self.requests.get(upstream, 0) + 1
+            roll = self._random.random()
+            delay = fault['latency'] + self._random.uniform(0, fault['jitter'])
+        if roll < fault['timeout_rate']:
+            time.sleep(fault['hang'])
+            return 'timeout'
+        if delay > 0:
+            time.sleep(delay)
+        if roll < fault['timeout_rate'] + fault['error_rate']:
+            return 'error'
+        return None
+
+    # ─── 响应 ─────────────────────────────────────────────
+    def _estimate(self, code):
+        """基金的净值与估值（jsonpgz 与多基金接口返回同一份数据），无估值时估值字段为 None"""
+        nav = 1 + _seed(code, 'nav') * 2
+        pct = (_seed(code, 'pct') - 0.5) * 4
+        if _seed(code, 'gsz') < self.no_estimate_rate:
+            return nav, None, None
+        return nav, nav * (1 + pct / 100), pct
+
+    def fundgz(self, code):
+        nav, gsz, pct = self._estimate(code)
+        return self.templates['fundgz.js'].substitute(
+            code=code, name=f"基准测试基金{code}", nav_date=self.nav_date, nav=f"{nav:.4f}",
+            gsz='' if gsz is None else f"{gsz:.4f}",
+            gszzl='' if gsz is None else f"{pct:.2f}",
+            gztime='' if gsz is None else self.gztime,
+        )
+
+    def fundmob(self, codes):
+        items = []
+        for code in codes:
+            nav, gsz, pct = self._estimate(code)
+            items.append(self.templates['fundmob_item.json'].substitute(
+                code=code, name=f"基准测试基金{code}", nav_date=self.nav_date, nav=f"{nav:.4f}",
+                gsz='--' if gsz is None else f"{gsz:.4f}",
+                gszzl='--' if gsz is None else f"{pct:.2f}",
+                gztime='--' if gsz is None else self.gztime,
+            ).strip())
+        return self.templates['fundmob.json'].substitute(
+            total=len(items), items=",".join(items), gztime=self.gztime, nav_date=self.nav_date,
+        )
+
+    @staticmethod
+    def _quote(secid):
+        prev_close = 1 + _seed(secid, 'close') * 50
+        pct = (_seed(secid, 'pct') - 0.5) * 6
+        return prev_close, prev_close * (1 + pct / 100), pct
+
+    def stock_get(self, secid):
+        prev_close, price, pct = self._quote(secid)
+        return self.templates['push2_stock.json'].substitute(
+            price=round(price * 1000), high=round(price * 1010), low=round(price * 990),
+            open=round(prev_close * 1000), prev_close=round(prev_close * 1000), pct=round(pct * 100),
+        )
+
+    def ulist(self, secids):
+        items = []
+        for secid in secids:
+            market, _, code = secid.partition('.')
+            prev_close, price, _pct = self._quote(secid)
+            items.append(self.templates['push2_ulist_item.json'].substitute(
+                price=f"{price:.3f}", code=code, market=int(market or 0), prev_close=f"{prev_close:.3f}",
+            ).strip())
+        return self.templates['push2_ulist.json'].substitute(total=len(items), items=",".join(items))
+
+    def tsdata(self, code):
+        level = 1 + int(_seed(code, 'risk') * 5)
+        choose = {f"choose{i}": ' chooseLow' if i == level else '' for i in range(1, 6)}
+        return self.templates['tsdata.html'].substitute(code=code, name=f"基准测试基金{code}", **choose)
+
+    def jjcc(self, code, topline=10):
+        start = int(_seed(code, 'holdings') * len(STOCK_POOL))
+        rows = []
+        for rank in range(1, min(topline, len(STOCK_POOL)) + 1):
+            secid, name = STOCK_POOL[(start + rank) % len(STOCK_POOL)]
+            rows.append(self.templates['jjcc_row.html'].substitute(
+                rank=rank, secid=secid, stock_code=secid.partition('.')[2], stock_name=name, code=code,
+                weight=f"{10 - rank * 0.6:.2f}", shares=f"{100 + rank * 7:.2f}", value=f"{5000 - rank * 300:.2f}",
+            ))
+        return self.templates['jjcc.js'].substitute(
+            code=code, name=f"基准测试基金{code}", period_name="2025年4季度", report_date="2025-12-31",
+            rows="".join(rows), year=2025,
+        )
+
+    # 维格表记录存储
+    def vika_list(self, page_size, page_num):
+        with self._lock:
+            records = [{'recordId': rid, 'fields': dict(fields)} for rid, fields in self.vika_records.items()]
+        page = records[(page_num - 1) * page_size:page_num * page_size]
+        return {'total': len(records), 'records': page, 'pageNum': page_num, 'pageSize': page_size}
+
+    def vika_create(self, records):
+        created = []
+        with self._lock:
+            for rec in records:
+                self._next_record += 1
+                rid = f"rec{self._next_record:08d}"
+                self.vika_records[rid] = dict(rec.get('fields') or {})
+                created.append({'recordId': rid, 'fields': dict(self.vika_records[rid])})
+        return {'records': created}
+
+    def vika_update(self, records):
+        updated = []
+        with self._lock:
+            for rec in records:
+                fields = self.vika_records.setdefault(rec['recordId'], {})
+                fields.update(rec.get('fields') or {})
+                updated.append({'recordId': rec['recordId'], 'fields': dict(fields)})
+        return {'records': updated}
+
+    def vika_delete(self, record_ids):
+        with self._lock:
+            for rid in record_ids:
+                self.vika_records.pop(rid, None)
+        return {}
+
+
+def _upstream_of(path):
+    if path.startswith('/js/'):
+        return 'fundgz'
+    if path.startswith('/FundMNewApi/'):
+        return 'fundmob'
+    if path.startswith('/api/qt/'):
+        return 'push2'
+    if path.startswith('/f10/') or path.startswith('/FundArchivesDatas'):
+        return 'f10'
+    if path.startswith('/datasheets/'):
+        return 'vika'
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub = None  # StubUpstreams，由 StubServer 绑定
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json; charset=utf-8'):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        upstream = _upstream_of(url.path)
+        if upstream is None:
+            return self._send(404, '{"message": "not found"}')
+
+        body = b''
+        if int(self.headers.get('Content-Length') or 0):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        outcome = self.stub.inject(upstream)
+        if outcome == 'timeout':
+            try:
+                return self._send(504, '{"message": "injected timeout"}')
+            except OSError:
+                return None  # 客户端已超时断开
+        if outcome == 'error':
+            return self._send(503, '{"success": false, "message": "injected error"}')
+
+        if upstream == 'fundgz':
+            code = url.path[len('/js/'):-len('.js')]
+            return self._send(200, self.stub.fundgz(code), 'application/javascript; charset=utf-8')
+        if upstream == 'fundmob':
+            return self._send(200, self.stub.fundmob([c for c in query.get('Fcodes', '').split(',') if c]))
+        if upstream == 'push2':
+            if url.path.endswith('/ulist.np/get'):
+                return self._send(200, self.stub.ulist([s for s in query.get('secids', '').split(',') if s]))
+            return self._send(200, self.stub.stock_get(query.get('secid', '')))
+        if upstream == 'f10':
+            if url.path.startswith('/FundArchivesDatas'):
+                return self._send(200, self.stub.jjcc(query.get('code', ''), int(query.get('topline') or 10)),
+                                  'text/javascript; charset=utf-8')
+            match = re.match(r'/f10/tsdata_(\w+)\.html', url.path)
+            return self._send(200, self.stub.tsdata(match.group(1) if match else ''), 'text/html; charset=utf-8')
+
+        # vika
+        payload = json.loads(body or b'{}')
+        if method == 'GET':
+            data = self.stub.vika_list(int(query.get('pageSize') or 100), int(query.get('pageNum') or 1))
+        elif method == 'POST':
+            data = self.stub.vika_create(payload.get('records') or [])
+        elif method == 'PATCH':
+            data = self.stub.vika_update(payload.get('records') or [])
+        elif method == 'DELETE':
+            data = self.stub.vika_delete([r for r in query.get('recordIds', '').split(',') if r])
+        else:
+            return self._send(405, '{"success": false}')
+        return self._send(200, json.dumps({'success': True, 'code': 200, 'data': data}, ensure_ascii=False))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class StubServer:
+    """在后台线程运行的桩服务器；url 为 http://127.0.0.1:<port>"""
+
+    def __init__(self, port=0, **options):
+        self.stub = StubUpstreams(**options)
+        handler = type('StubHandler', (_Handler,), {'stub': self.stub})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def upstream_env(self):
+        """指向本服务器的环境变量（需在导入 http_client 前设置）"""
+        return {
+            'UPSTREAM_FUNDGZ_BASE_URL': self.url,
+            'UPSTREAM_FUNDMOB_BASE_URL': self.url,
+            'UPSTREAM_PUSH2_BASE_URL': self.url,
+            'UPSTREAM_F10_BASE_URL': self.url,
+            'UPSTREAM_VIKA_BASE_URL': self.url,
+            'FUND_HOLDINGS_URL': f"{self.url}/FundArchivesDatas.aspx",
+        }
+
+
+def parse_fault(text):
+    """解析 --fault 参数：upstream.field=value"""
+    target, _, value = text.partition('=')
+    upstream, _, field = target.partition('.')
+    if not upstream or field not in FAULT_FIELDS or not value:
+        raise argparse.ArgumentTypeError(f"格式应为 upstream.field=value，field 可选: {', '.join(FAULT_FIELDS)}")
+    return upstream, field, float(value)
+
+
+def add_fault_arguments(parser):
+    """桩服务器的故障注入参数（与 run_bench.py 共用）"""
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.0, help="额外随机延迟上限（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="挂起 hang 秒后才响应的比例")
+    parser.add_argument('--hang', type=float, default=15.0, help="超时注入的挂起时间（秒）")
+    parser.add_argument('--no-estimate-rate', type=float, default=0.05, help="fundgz 无实时估值 (gsz 为空) 的比例")
+    parser.add_argument('--fault', type=parse_fault, action='append', default=[],
+                        help="按上游覆盖故障参数，如 fundgz.error_rate=1（可重复）")
+
+
+def server_from_args(args, port=0):
+    server = StubServer(
+        port=port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, hang=args.hang, no_estimate_rate=args.no_estimate_rate,
+    )
+    for upstream, field, value in args.fault:
+        server.stub.set_fault(upstream, **{field: value})
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地上游桩服务器")
+    parser.add_argument('--port', type=int, default=8765)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, args.port)
+    print(f"🧪 桩服务器已启动: {server.url}")
+    for key, value in server.upstream_env().items():
+        print(f"   export {key}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
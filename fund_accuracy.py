@@ -0,0 +1,181 @@
+"""
+估值准确度统计
+把每个交易日各来源的收盘估值与当日官方净值对比，统计误差并生成每只基金的首选估值来源
+- 数据来自 fund_history（盘中估值 + 官方净值）
+- 基准来源 nav：以前一日净值作为估值（即不估算）
+- 结果写入 data/cache/source_ranking.json，供 calculate_fund_estimate 选择估值方案
+  （运行中的服务按文件 mtime 自动重新读取，不需要重启）
+
+用法: python fund_accuracy.py [--days 60] [--min-samples 5] [--output report.csv]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import fund_history
+from fund_io import atomic_write_json
+
+SOURCE_NAV = 'nav'  # 基准：昨日净值
+
+RANKING_FILE = os.environ.get("SOURCE_RANKING_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'cache', 'source_ranking.json'
+)
+# 参与排序所需的最少样本天数
+MIN_SAMPLES = int(os.environ.get("SOURCE_RANKING_MIN_SAMPLES", "5"))
+# 两次检查排序文件是否被更新的最小间隔（秒）
+RANKING_RELOAD_INTERVAL = float(os.environ.get("SOURCE_RANKING_RELOAD_INTERVAL", "1"))
+
+
+def daily_errors(codes=None, start=None, end=None):
+    """
+    各来源每日收盘估值与官方净值的误差
+    返回 DataFrame[code, date, source, estimate_nav, nav, error_pct, abs_error_pct]
+    error_pct = (估值 - 净值) / 净值 * 100
+    """
+    import pandas as pd
+
+    estimates = fund_history.estimates_frame(codes, start, end)
+    navs = fund_history.navs_frame(codes)
+    columns = ['code', 'date', 'source', 'estimate_nav', 'nav', 'error_pct', 'abs_error_pct']
+    if estimates.empty or navs.empty:
+        return pd.DataFrame(columns=columns)
+
+    # 每个 代码/日期/来源 取当天最后一次估值
+    estimates['date'] = estimates['ts'].dt.normalize()
+    eod = (estimates.sort_values('ts')
+           .groupby(['code', 'date', 'source'], as_index=False)
+           .last()[['code', 'date', 'source', 'estimate_nav']])
+
+    # 基准：前一个净值日的净值
+    navs = navs.sort_values(['code', 'date'])
+    baseline = navs.assign(estimate_nav=navs.groupby('code')['nav'].shift(1), source=SOURCE_NAV)
+    baseline = baseline.dropna(subset=['estimate_nav'])
+    baseline = baseline.merge(eod[['code', 'date']].drop_duplicates(), on=['code', 'date'])
+
+    joined = pd.concat([eod, baseline[['code', 'date', 'source', 'estimate_nav']]], ignore_index=True)
+    joined = joined.merge(navs[['code', 'date', 'nav']], on=['code', 'date'], how='inner')
+    joined['error_pct'] = (joined['estimate_nav'] - joined['nav']) / joined['nav'] * 100
+    joined['abs_error_pct'] = joined['error_pct'].abs()
+    return joined[columns].sort_values(['code', 'date', 'source'], ignore_index=True)
+
+
+def accuracy_stats(errors):
+    """
+    按 代码+来源 汇总误差
+    返回 DataFrame[code, source, samples, mae, rmse, bias, max_abs_error, rank]
+    rank 为同一基金内按 mae 升序的名次（1 为最准）
+    """
+    import numpy as np
+
+    grouped = errors.assign(sq_error=np.square(errors['error_pct'])).groupby(['code', 'source'])
+    stats = grouped.agg(
+        samples=('error_pct', 'size'),
+        mae=('abs_error_pct', 'mean'),
+        mse=('sq_error', 'mean'),
+        bias=('error_pct', 'mean'),
+        max_abs_error=('abs_error_pct', 'max'),
+    ).reset_index()
+    stats['rmse'] = np.sqrt(stats.pop('mse'))
+    stats['rank'] = stats.groupby('code')['mae'].rank(method='first').astype(int)
+    return stats[['code', 'source', 'samples', 'mae', 'rmse', 'bias', 'max_abs_error', 'rank']] \
+        .sort_values(['code', 'rank'], ignore_index=True)
+
+
+def build_ranking(stats, min_samples=None):
+    """每只基金的来源排序 {code: [source, ...]}，样本不足的来源不参与"""
+    if min_samples is None:
+        min_samples = MIN_SAMPLES
+    eligible = stats[stats['samples'] >= min_samples].sort_values(['code', 'mae'])
+    return {code: list(group['source']) for code, group in eligible.groupby('code')}
+
+
+# ─── 排序结果读写（估值路径使用） ─────────────────────────
+_ranking = None
+_ranking_mtime = None
+_ranking_checked_at = 0.0
+_ranking_lock = threading.Lock()
+
+
+def _file_mtime():
+    try:
+        return os.stat(RANKING_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def save_ranking(ranking):
+    global _ranking, _ranking_mtime
+    atomic_write_json(RANKING_FILE,
+                      {'generated_at': datetime.now().isoformat(timespec='seconds'), 'ranking': ranking},
+                      ensure_ascii=False, indent=1)
+    with _ranking_lock:
+        _ranking = ranking
+        _ranking_mtime = _file_mtime()
+
+
+def load_ranking():
+    """来源排序（内存缓存；首次访问或排序文件被 fund_accuracy 任务更新后重新读取）"""
+    global _ranking, _ranking_mtime, _ranking_checked_at
+    with _ranking_lock:
+        now = time.monotonic()
+        if _ranking is not None and now - _ranking_checked_at < RANKING_RELOAD_INTERVAL:
+            return _ranking
+        _ranking_checked_at = now
+        mtime = _file_mtime()
+        if _ranking is None or mtime != _ranking_mtime:
+            _ranking, _ranking_mtime = {}, mtime
+            if mtime is not None:
+                try:
+                    with open(RANKING_FILE, 'r', encoding='utf-8') as f:
+                        _ranking = json.load(f).get('ranking', {})
+                except Exception as e:
+                    print(f"⚠️  读取估值来源排序失败: {e}")
+        return _ranking
+
+
+def preferred_source(code):
+    """该基金历史上最准的估值来源，无统计时返回 None"""
+    sources = load_ranking().get(code)
+    return sources[0] if sources else None
+
+
+def run(days=60, min_samples=None, output=None, codes=None):
+    """统计最近 days 天的准确度，更新来源排序并可选导出报告（.csv 或 .json）"""
+    start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    errors = daily_errors(codes, start=start)
+    if errors.empty:
+        print("ℹ️  暂无可对比的估值与净值数据")
+        return None
+
+    stats = accuracy_stats(errors)
+    ranking = build_ranking(stats, min_samples)
+    save_ranking(ranking)
+    print(f"✅ 统计 {stats['code'].nunique()} 只基金、{len(errors)} 条样本，已更新 {len(ranking)} 只基金的首选来源")
+
+    if output:
+        if output.endswith('.json'):
+            stats.to_json(output, orient='records', force_ascii=False, indent=1)
+        else:
+            stats.to_csv(output, index=False, encoding='utf-8-sig')
+        print(f"📄 报告已导出: {output}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="估值准确度统计")
+    parser.add_argument('--days', type=int, default=60, help="统计最近多少天（默认 60）")
+    parser.add_argument('--min-samples', type=int, default=None, help="参与排序的最少样本数")
+    parser.add_argument('--output', help="导出报告路径（.csv 或 .json）")
+    args = parser.parse_args()
+
+    stats = run(args.days, args.min_samples, args.output)
+    if stats is not None:
+        print(stats.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+异步估值流水线（asyncio + httpx）
+- 天天基金 jsonpgz、多基金估值（fundmob）、东方财富行情（push2）直接在事件循环中发起异步请求，不占用线程：
+  每个上游一个 httpx.AsyncClient（连接池 + keep-alive）和一个 asyncio.Semaphore（并发上限），
+  超时、重试/退避、熔断器和 metrics 与 http_client.request 一致（熔断器与同步请求共用）
+- 单只基金的 jsonpgz / ETF 行情经 estimate_cache.aget_or_load 读取，与同步调用方共享缓存和 single-flight
+- 风险评级 / 持仓（F10，有持久化缓存）、维格表同步和估值计算（回退方案、历史记录）仍是同步代码，在线程中执行
+- 批量估值先并发抓取全部输入（多基金估值、批量行情、jsonpgz、风险评级），再逐只计算估值（命中缓存，不再请求）
+- 客户端按事件循环创建，run() / session() 结束时关闭；fund_tracker 中的同步批量接口是本模块的薄包装
+"""
+
+import asyncio
+import contextlib
+import threading
+import time
+import weakref
+
+import httpx
+
+import fund_holdings
+import fund_meta
+import fund_tracker
+import http_client
+import metrics
+from fund_cache import estimate_cache
+
+# 重试的请求方法（与 http_client 的 Retry 配置一致）
+RETRY_METHODS = frozenset(["GET", "HEAD", "PATCH", "DELETE"])
+
+
+class AsyncHTTPClient:
+    """
+    共享异步 HTTP 客户端
+    - AsyncClient 和信号量按 (事件循环, 上游) 创建，同一事件循环内每个上游的在途请求不超过其 concurrency
+    - 上游配置（base_url / timeout / retries / read_retries / backoff / verify / headers）取自 http_client.UPSTREAMS
+    """
+
+    def __init__(self):
+        self._slots = weakref.WeakKeyDictionary()  # loop -> {upstream: (AsyncClient, Semaphore)}
+        self._lock = threading.Lock()
+
+    def _slot(self, upstream):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._slots.setdefault(loop, {})
+            slot = slots.get(upstream)
+            if slot is None:
+                cfg = http_client.UPSTREAMS[upstream]
+                client = httpx.AsyncClient(
+                    headers=cfg.get("headers") or {},
+                    verify=cfg["verify"],
+                    timeout=cfg["timeout"],
+                    limits=httpx.Limits(max_connections=cfg["concurrency"],
+                                        max_keepalive_connections=cfg["concurrency"]),
+                )
+                slot = slots[upstream] = (client, asyncio.Semaphore(cfg["concurrency"]))
+            return slot
+
+    async def request(self, upstream, method, path, **kwargs):
+        """
+        参数与 http_client.request 相同（params / headers / json / timeout 等）
+        上游熔断中时立即抛出 CircuitOpenError；连接错误、读超时（read_retries 次）和 429/5xx 按上游配置重试
+        """
+        cfg = http_client.UPSTREAMS[upstream]
+        url = http_client.build_url(upstream, path)
+        tier = metrics.current_tags().get("tier", "")
+        breaker = http_client.get_breaker(upstream)
+        if not breaker.allow():
+            metrics.UPSTREAM_ERRORS.inc(upstream=upstream, reason="circuit_open", tier=tier)
+            metrics.log_event("upstream", upstream=upstream, method=method, status="circuit_open", elapsed=0)
+            raise http_client.CircuitOpenError(f"上游 {upstream} 熔断中，跳过请求")
+
+        client, semaphore = self._slot(upstream)
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                response = await self._send(client, cfg, method, url, **kwargs)
+            except Exception as e:
+                elapsed = time.monotonic() - started
+                breaker.record(True, elapsed)
+                http_client._observe(upstream, method, "error", tier, elapsed, type(e).__name__)
+                raise
+        elapsed = time.monotonic() - started
+        failed = response.status_code >= 500 or response.status_code == 429
+        breaker.record(failed, elapsed)
+        http_client._observe(upstream, method, response.status_code, tier, elapsed,
+                             f"http_{response.status_code}" if failed else None)
+        return response
+
+    async def _send(self, client, cfg, method, url, **kwargs):
+        retries = cfg["retries"] if method in RETRY_METHODS else 0
+        read_retries = retries if cfg["read_retries"] is None else min(retries, cfg["read_retries"])
+        attempt = 0
+        while True:
+            try:
+                response = await client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= retries:
+                    raise
+            except (httpx.ReadError, httpx.ReadTimeout):
+                if attempt >= read_retries:
+                    raise
+            else:
+                if response.status_code not in http_client.RETRY_STATUS or attempt >= retries:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    attempt += 1
+                    await asyncio.sleep(float(retry_after))
+                    continue
+            attempt += 1
+            # 与 urllib3 相同：第一次重试立即进行，之后按 backoff * 2^(n-1) 退避
+            if attempt > 1:
+                await asyncio.sleep(cfg["backoff"] * 2 ** (attempt - 1))
+
+    async def get(self, upstream, path, **kwargs):
+        return await self.request(upstream, "GET", path, **kwargs)
+
+    async def aclose(self):
+        """关闭当前事件循环创建的 AsyncClient"""
+        with self._lock:
+            slots = self._slots.pop(asyncio.get_running_loop(), {})
+        for client, _semaphore in slots.values():
+            await client.aclose()
+
+
+client = AsyncHTTPClient()
+
+
+@contextlib.asynccontextmanager
+async def session():
+    """在当前事件循环中使用共享客户端，退出时关闭本事件循环的连接（Flask 异步视图每个请求一个事件循环）"""
+    try:
+        yield client
+    finally:
+        await client.aclose()
+
+
+def run(coro):
+    """asyncio.run 执行协程（同步入口使用），结束前关闭连接"""
+    async def main():
+        async with session():
+            return await coro
+    return asyncio.run(main())
+
+
+# ─── 单项抓取（与 fund_tracker 中的同步函数一一对应）─────────
+async def fetch_fundgz(fund_code, use_cache=True):
+    """异步版 fund_tracker.fetch_fundgz：与同步调用共用缓存，并发请求同一基金时只请求一次"""
+    if not use_cache:
+        return await _fetch_fundgz(fund_code)
+    return await estimate_cache.aget_or_load(
+        f"fundgz:{fund_code}",
+        lambda: _fetch_fundgz(fund_code),
+        cacheable=lambda result: result['success'],
+    )
+
+
+async def _fetch_fundgz(fund_code):
+    try:
+        response = await client.get("fundgz", f"/js/{fund_code}.js")
+    except Exception as e:
+        return fund_tracker._fundgz_request_failed(e)
+    return fund_tracker._parse_fundgz(fund_code, response)
+
+
+async def prefetch_fundgz(fund_codes, use_cache=True):
+    """异步版 fund_tracker.prefetch_fundgz（各批次并发请求）"""
+    codes = [c for c in dict.fromkeys(fund_codes) if c]
+    if use_cache:
+        codes = [c for c in codes if not estimate_cache.peek(f"fundgz:{c}")[0]]
+    batches = await asyncio.gather(*(_fetch_fundgz_batch(chunk) for chunk in fund_tracker._fundgz_chunks(codes)))
+    results = {}
+    for fetched in batches:
+        fund_tracker._store_fundgz(results, fetched, use_cache)
+    return results
+
+
+async def _fetch_fundgz_batch(codes):
+    try:
+        response = await client.get("fundmob", fund_tracker.FUNDMOB_PATH, params=fund_tracker._fundmob_params(codes))
+        return fund_tracker._parse_fundmob(response)
+    except Exception as e:
+        if not isinstance(e, http_client.CircuitOpenError):
+            print(f"⚠️  批量获取估值失败: {e}")
+        return {}
+
+
+async def get_fund_realtime_data(fund_code, use_cache=True):
+    """异步版 fund_tracker.get_fund_realtime_data"""
+    return fund_tracker.get_fund_realtime_data(fund_code, fundgz=await fetch_fundgz(fund_code, use_cache))
+
+
+async def get_fund_basic_info(fund_code):
+    """异步版 fund_tracker.get_fund_basic_info"""
+    return fund_tracker.get_fund_basic_info(fund_code, fundgz=await fetch_fundgz(fund_code))
+
+
+async def get_etf_quote(etf_code, use_cache=True):
+    """异步版 fund_tracker.get_etf_quote，失败返回 None"""
+    if not use_cache:
+        return await _fetch_etf_quote(etf_code)
+    return await estimate_cache.aget_or_load(
+        f"etf:{etf_code}",
+        lambda: _fetch_etf_quote(etf_code),
+        cacheable=lambda quote: quote is not None,
+    )
+
+
+async def _fetch_etf_quote(etf_code):
+    try:
+        response = await client.get("push2", "/api/qt/stock/get", params=fund_tracker._etf_quote_params(etf_code))
+        return fund_tracker._parse_etf_quote(response)
+    except Exception:
+        return None
+
+
+async def get_etf_quotes(etf_codes, use_cache=True):
+    """异步版 fund_tracker.get_etf_quotes（各批次并发请求）"""
+    return await _get_quotes(etf_codes, "etf", use_cache)
+
+
+async def get_quotes(secids, use_cache=True):
+    """异步版 fund_tracker.get_quotes（各批次并发请求）"""
+    return await _get_quotes(secids, "quote", use_cache)
+
+
+async def _get_quotes(codes, cache_prefix, use_cache=True):
+    quotes, missing = fund_tracker._cached_quotes(codes, cache_prefix, use_cache)
+    batches = await asyncio.gather(*(_fetch_quotes(chunk) for chunk in fund_tracker._quote_chunks(missing)))
+    for fetched in batches:
+        fund_tracker._store_quotes(quotes, fetched, cache_prefix, use_cache)
+    return quotes
+
+
+async def _fetch_quotes(codes):
+    params, secids = fund_tracker._quotes_params(codes)
+    try:
+        response = await client.get("push2", "/api/qt/ulist.np/get", params=params)
+        return fund_tracker._parse_quotes(response, secids)
+    except Exception as e:
+        print(f"⚠️  批量获取行情失败: {e}")
+        return {}
+
+
+async def get_fund_risk_level(fund_code, use_cache=True):
+    """异步版 fund_tracker.get_fund_risk_level（F10 页面，经 fund_meta 持久化缓存，未命中时在线程中抓取）"""
+    if use_cache:
+        fresh, value = fund_meta.lookup(fund_code, 'risk_level')
+        if fresh:
+            return value
+    return await asyncio.to_thread(fund_tracker.get_fund_risk_level, fund_code, use_cache)
+
+
+async def update_vika_table(records, raise_errors=False):
+    """
+    异步版 fund_tracker.update_vika_table
+    维格表写入受 vika_sync 的全局限流约束，整次同步在线程中顺序执行
+    """
+    return await asyncio.to_thread(fund_tracker.update_vika_table, records, raise_errors)
+
+
+# ─── 批量估值 ─────────────────────────────────────────────
+async def prefetch_inputs(funds):
+    """
+    估值（多基金接口）、ETF联接基金的行情、主动型/债券型基金（已缓存持仓）的成分行情并发批量预取
+    """
+    with metrics.tagged(tier='prefetch'):
+        fund_codes = [f['code'] for f in funds] if fund_tracker.FUNDGZ_BATCH else []
+        etf_codes = [f.get('etf_code') for f in funds if f.get('type') == 'etf_linked']
+        secids = [secid for f in funds if f.get('type') in ('active', 'bond')
+                  for secid, _weight in fund_holdings.components(f, fetch=False)[1]]
+        await asyncio.gather(prefetch_fundgz(fund_codes), get_etf_quotes(etf_codes), get_quotes(secids))
+
+
+async def _risk_level(fund):
+    with metrics.tagged(fund=fund['code'], tier='meta'):
+        return fund.get('risk_level') or await get_fund_risk_level(fund['code']) or '未知'
+
+
+async def _fundgz(fund):
+    with metrics.tagged(fund=fund['code'], tier='fundgz'):
+        return await fetch_fundgz(fund['code'])
+
+
+async def _prefetch_fund(fund):
+    """并发抓取单个基金的风险评级和 jsonpgz，返回 (估值用的基金配置, fundgz 结果)"""
+    risk_level, fundgz = await asyncio.gather(_risk_level(fund), _fundgz(fund))
+    return {**fund, 'risk_level': risk_level}, fundgz
+
+
+async def calculate_fund_estimate(fund, compute_slots=None):
+    """
+    异步获取单个基金的估值（结果与 fund_tracker.calculate_fund_estimate 相同）
+    网络输入在事件循环中并发抓取，估值计算（回退方案、历史记录）在线程中执行
+    compute_slots: 限制同时计算的基金数的 asyncio.Semaphore
+    """
+    fund, fundgz = await _prefetch_fund(fund)
+    async with compute_slots or contextlib.nullcontext():
+        return await asyncio.to_thread(fund_tracker.calculate_fund_estimate, fund, fundgz)
+
+
+async def iter_fund_estimates(funds, max_workers=None, timeout=None):
+    """
+    异步版 fund_tracker.iter_fund_estimates：按完成顺序逐个产出 (index, fund, result)
+    - result 为 FundEstimate、None（获取失败）或异常（含超时 TimeoutError）
+    - timeout 为整批的总截止时间（秒），到期后未完成的基金以 TimeoutError 产出
+    - max_workers 限制同时进行估值计算的基金数
+    """
+    funds = list(funds)
+    if not funds:
+        return
+    if max_workers is None:
+        max_workers = fund_tracker.ESTIMATE_MAX_WORKERS
+    if timeout is None:
+        timeout = fund_tracker.ESTIMATE_BATCH_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    compute_slots = asyncio.Semaphore(max(1, max_workers))
+    prefetch = asyncio.ensure_future(prefetch_inputs(funds))
+    done, _pending = await asyncio.wait({prefetch}, timeout=max(0, deadline - time.monotonic()))
+    if not done:
+        prefetch.cancel()
+    elif prefetch.exception() is not None:
+        print(f"⚠️  行情预取失败: {prefetch.exception()}")
+
+    tasks = {asyncio.ensure_future(calculate_fund_estimate(fund, compute_slots)): i for i, fund in enumerate(funds)}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in sorted(done, key=tasks.get):
+                i = tasks[task]
+                error = task.exception()
+                if error is not None:
+                    print(f"   ❌ 基金 {funds[i].get('code')} 估值出错: {error}")
+                    yield i, funds[i], error
+                else:
+                    yield i, funds[i], task.result()
+        if pending:
+            print(f"⏱️  批量估值超时 ({timeout}s)，{len(pending)} 个基金未完成")
+            for task in sorted(pending, key=tasks.get):
+                i = tasks[task]
+                yield i, funds[i], TimeoutError(f"估值超时 ({timeout}s)")
+    finally:
+        # 不等待超时的任务，直接返回已完成部分
+        for task in pending:
+            task.cancel()
+
+
+async def calculate_fund_estimates(funds, max_workers=None, timeout=None, return_exceptions=False):
+    """
+    异步批量估值（fund_tracker.calculate_fund_estimates 的异步实现）
+    - 返回 FundEstimate 列表，与 funds 顺序一一对应，失败项为 None
+    - timeout 为整批的总截止时间（秒），到期后未完成的基金不再等待
+    - return_exceptions=True 时，异常（含超时 TimeoutError）按位置放入结果列表
+    - max_workers 限制同时进行估值计算的基金数
+    """
+    funds = list(funds)
+    results = [None] * len(funds)
+    async for i, _fund, result in iter_fund_estimates(funds, max_workers, timeout):
+        if isinstance(result, Exception) and not return_exceptions:
+            continue
+        results[i] = result
+    return results
@@ -0,0 +1,272 @@
+"""
+进程内估值缓存
+- 按 A 股交易时段决定过期时间：盘中短 TTL，盘后/午休/周末保持到下一次开盘
+- 同一 key 的并发请求合并为一次上游调用（single-flight，同步线程与异步协程之间同样合并）
+- 暴露命中/未命中计数，便于评估缓存规模；批量接口预取回填（put）的条目单独计数，不计入命中率
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+from zoneinfo import ZoneInfo
+
+MARKET_TZ = ZoneInfo("Asia/Shanghai")
+
+# 交易时段（收盘后留几分钟宽限，等待最终估值落定）
+TRADING_SESSIONS = (
+    (dtime(9, 30), dtime(11, 30)),
+    (dtime(13, 0), dtime(15, 0)),
+)
+CLOSE_GRACE = timedelta(minutes=5)
+
+# 盘中缓存时间（秒）：fundgz 的 gztime 约每分钟变动一次
+SESSION_TTL = float(os.environ.get("CACHE_SESSION_TTL", "60"))
+
+# 休市日（周末以外的法定节假日），格式 YYYY-MM-DD，逗号分隔
+MARKET_HOLIDAYS = {
+    d.strip() for d in os.environ.get("MARKET_HOLIDAYS", "").split(",") if d.strip()
+}
+
+
+def market_now():
+    return datetime.now(MARKET_TZ)
+
+
+def is_trading_day(day):
+    """是否交易日（周一至周五且不在休市日列表中）"""
+    return day.weekday() < 5 and day.strftime("%Y-%m-%d") not in MARKET_HOLIDAYS
+
+
+def is_trading_time(now=None):
+    """当前是否处于交易时段（含收盘宽限）"""
+    now = now or market_now()
+    if not is_trading_day(now):
+        return False
+    for start, end in TRADING_SESSIONS:
+        session_start = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+        session_end = now.replace(hour=end.hour, minute=end.minute, second=0, microsecond=0) + CLOSE_GRACE
+        if session_start <= now < session_end:
+            return True
+    return False
+
+
+def next_market_open(now=None):
+    """下一个交易时段的开始时间"""
+    now = now or market_now()
+    day = now
+    for _ in range(30):
+        if is_trading_day(day):
+            for start, _end in TRADING_SESSIONS:
+                session_start = day.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+                if session_start > now:
+                    return session_start
+        day = (day + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return now + timedelta(days=1)
+
+
+def last_session_date(now=None):
+    """最近一个已开盘的交易日（当天尚未开盘时为上一个交易日）"""
+    now = now or market_now()
+    first_open = TRADING_SESSIONS[0][0]
+    day = now
+    if now.time() < first_open:
+        day -= timedelta(days=1)
+    for _ in range(30):
+        if is_trading_day(day):
+            return day.date()
+        day -= timedelta(days=1)
+    return now.date()
+
+
+def next_tick(now=None):
+    """下一次估值可能变化的时间：盘中为下一个整分钟（gztime 按分钟更新），否则为下一次开盘"""
+    now = now or market_now()
+    if is_trading_time(now):
+        return now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return next_market_open(now)
+
+
+def market_ttl(now=None):
+    """缓存有效期（秒）：盘中为 SESSION_TTL，否则持续到下一次开盘"""
+    now = now or market_now()
+    if is_trading_time(now):
+        return SESSION_TTL
+    return max(SESSION_TTL, (next_market_open(now) - now).total_seconds())
+
+
+class _Flight:
+    """一次进行中的加载"""
+    __slots__ = ("event", "value", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = []  # 异步调用方 [(loop, future)]，可能来自不同线程的事件循环
+
+    def finish(self):
+        """通知所有等待者（同步调用方等 event，异步调用方的 future 在各自的事件循环中完成）"""
+        self.event.set()
+        for loop, future in self.waiters:
+            loop.call_soon_threadsafe(self._resolve, future)
+
+    def _resolve(self, future):
+        if future.done():
+            return
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result(self.value)
+
+
+class TTLCache:
+    """线程安全的 TTL 缓存，同一 key 的并发加载只触发一次 loader（同步、异步调用方之间同样合并）"""
+
+    def __init__(self, ttl_func=market_ttl):
+        self.ttl_func = ttl_func
+        self._data = {}       # key -> (expires_at, value)
+        self._inflight = {}   # key -> _Flight
+        self._seeded = set()  # 由 put 回填、尚未被读取过的 key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.seeded = 0         # put 回填次数
+        self.prefetch_hits = 0  # 回填条目的首次读取（批量预取省下的请求，不算缓存复用）
+
+    def _begin(self, key, future=None):
+        """
+        返回 (_Flight, 是否由本调用加载, 缓存值)；命中时 _Flight 为 None
+        future 为异步调用方的等待对象，跟随已有加载时登记到该加载上
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                if key in self._seeded:
+                    self._seeded.discard(key)
+                    self.prefetch_hits += 1
+                else:
+                    self.hits += 1
+                return None, False, entry[1]
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.misses += 1
+                return flight, True, None
+            self.coalesced += 1
+            if future is not None:
+                flight.waiters.append((future.get_loop(), future))
+            return flight, False, None
+
+    def _store(self, key, value, cacheable):
+        if cacheable is None or cacheable(value):
+            ttl = self.ttl_func()
+            with self._lock:
+                self._data[key] = (time.monotonic() + ttl, value)
+                self._seeded.discard(key)
+
+    def _end(self, key, flight):
+        with self._lock:
+            self._inflight.pop(key, None)
+        flight.finish()
+
+    def get_or_load(self, key, loader, cacheable=None):
+        """
+        读取缓存；过期或不存在时调用 loader()
+        cacheable(value) 返回 False 时不写入缓存（如上游失败）
+        正在加载的 key 上的并发调用等待并共享同一次加载结果（包括异常）
+        """
+        flight, leader, value = self._begin(key)
+        if flight is None:
+            return value
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self._store(key, flight.value, cacheable)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._end(key, flight)
+
+    async def aget_or_load(self, key, loader, cacheable=None):
+        """
+        get_or_load 的异步版本：loader 为返回协程的可调用对象
+        跟随其他线程 / 事件循环中进行的加载时不阻塞事件循环
+        """
+        import asyncio
+
+        future = asyncio.get_running_loop().create_future()
+        flight, leader, value = self._begin(key, future)
+        if flight is None:
+            return value
+        if not leader:
+            return await future
+
+        try:
+            flight.value = await loader()
+            self._store(key, flight.value, cacheable)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._end(key, flight)
+
+    def peek(self, key):
+        """读取未过期的缓存值，返回 (是否命中, 值)；不影响命中统计"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                return True, entry[1]
+            return False, None
+
+    def put(self, key, value):
+        """
+        直接写入缓存（用于批量接口的结果回填）
+        回填条目的首次读取计入 prefetch_hits，之后的读取才算缓存命中
+        """
+        ttl = self.ttl_func()
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._seeded.add(key)
+            self.seeded += 1
+
+    def invalidate(self, key=None):
+        """删除单个 key；不传 key 时清空缓存"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self._seeded.clear()
+            else:
+                self._data.pop(key, None)
+                self._seeded.discard(key)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            live = sum(1 for expires_at, _ in self._data.values() if expires_at > now)
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "seeded": self.seeded,
+                "prefetch_hits": self.prefetch_hits,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._data),
+                "live": live,
+                "trading": is_trading_time(),
+            }
+
+
+# 全局估值缓存：key 形如 "realtime:002963"、"etf:159934"
+estimate_cache = TTLCache()
@@ -0,0 +1,21 @@
+"""
+.env 加载（本地开发使用，GitHub Actions 不需要）
+各模块在导入时读取环境变量配置，入口（app.py、python fund_tracker.py 等）须在导入其他项目模块之前调用 load_environment()
+本模块不依赖任何项目模块，python-dotenv 在调用时才导入
+"""
+
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_environment():
+    """加载 .env 文件（不覆盖已有的环境变量），只执行一次"""
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        _loaded = True
+    from dotenv import load_dotenv
+    load_dotenv(verbose=False)
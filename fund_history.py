@@ -0,0 +1,151 @@
+"""
+基金估值与净值历史
+本地只追加的时间序列库（SQLite，主键即 (code, ts) 索引）
+- estimates: 每次获取到的盘中估值（按 代码+估值时间+来源 去重）
+- navs: 每个净值日期的官方单位净值 dwjz
+查询接口返回 pandas DataFrame，供日内走势和回测使用
+"""
+
+import os
+import sqlite3
+import threading
+
+FUND_HISTORY_ENABLED = os.environ.get("FUND_HISTORY", "1") != "0"
+FUND_HISTORY_DB = os.environ.get("FUND_HISTORY_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'history.db'
+)
+
+# 估值来源
+SOURCE_FUNDGZ = 'fundgz'   # 天天基金网实时估值
+SOURCE_ETF = 'etf'         # ETF价格计算
+SOURCE_HOLDINGS = 'holdings'    # 重仓股加权估算
+SOURCE_BENCHMARK = 'benchmark'  # 基准指数估算
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS estimates ("
+    " code TEXT NOT NULL, ts TEXT NOT NULL, source TEXT NOT NULL,"
+    " estimate_nav REAL NOT NULL, latest_nav REAL, change_pct REAL,"
+    " PRIMARY KEY (code, ts, source)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS navs ("
+    " code TEXT NOT NULL, date TEXT NOT NULL, nav REAL NOT NULL,"
+    " PRIMARY KEY (code, date)) WITHOUT ROWID",
+)
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection():
+    """进程内共享一个连接（WAL 模式，写入串行化）"""
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(FUND_HISTORY_DB), exist_ok=True)
+        conn = sqlite3.connect(FUND_HISTORY_DB, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        _conn = conn
+    return _conn
+
+
+def _execute_many(sql, rows):
+    if not FUND_HISTORY_ENABLED or not rows:
+        return
+    try:
+        with _lock:
+            conn = _connection()
+            conn.executemany(sql, rows)
+            conn.commit()
+    except Exception as e:
+        print(f"⚠️  写入历史数据失败: {e}")
+
+
+def record_estimate(code, ts, estimate_nav, source, latest_nav=None, change_pct=None):
+    """记录一条盘中估值（同一代码、时间、来源只保留第一条）"""
+    record_estimates([(code, ts, source, estimate_nav, latest_nav, change_pct)])
+
+
+def record_estimates(rows):
+    """批量记录估值 [(code, ts, source, estimate_nav, latest_nav, change_pct), ...]"""
+    _execute_many(
+        "INSERT OR IGNORE INTO estimates (code, ts, source, estimate_nav, latest_nav, change_pct)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def record_nav(code, nav_date, nav):
+    """记录官方单位净值"""
+    record_navs([(code, nav_date, nav)])
+
+
+def record_navs(rows):
+    """批量记录净值 [(code, date, nav), ...]"""
+    _execute_many("INSERT OR IGNORE INTO navs (code, date, nav) VALUES (?, ?, ?)", rows)
+
+
+def latest_nav(code):
+    """最近一条官方净值 (date, nav)，无记录时返回 None"""
+    if not FUND_HISTORY_ENABLED:
+        return None
+    try:
+        with _lock:
+            return _connection().execute(
+                "SELECT date, nav FROM navs WHERE code = ? ORDER BY date DESC LIMIT 1", (code,)
+            ).fetchone()
+    except Exception as e:
+        print(f"⚠️  读取历史净值失败: {e}")
+        return None
+
+
+def _where(codes, start, end, time_column, extra=None):
+    clauses, params = [], []
+    if codes:
+        codes = [codes] if isinstance(codes, str) else list(codes)
+        clauses.append(f"code IN ({','.join('?' * len(codes))})")
+        params.extend(codes)
+    if start:
+        clauses.append(f"{time_column} >= ?")
+        params.append(str(start))
+    if end:
+        end = str(end)
+        if time_column == 'ts' and len(end) == 10:
+            end += ' 23:59:59'  # 只给日期时包含当天全部估值
+        clauses.append(f"{time_column} <= ?")
+        params.append(end)
+    for column, value in (extra or {}).items():
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _query_frame(sql, params, time_column):
+    import pandas as pd
+
+    with _lock:
+        frame = pd.read_sql_query(sql, _connection(), params=params)
+    frame[time_column] = pd.to_datetime(frame[time_column])
+    return frame
+
+
+def estimates_frame(codes=None, start=None, end=None, source=None):
+    """
+    查询盘中估值
+    返回 DataFrame[code, ts, source, estimate_nav, latest_nav, change_pct]，按 code、ts 排序
+    start/end 为 "YYYY-MM-DD" 或 "YYYY-MM-DD HH:MM"（闭区间）
+    """
+    where, params = _where(codes, start, end, 'ts', {'source': source})
+    return _query_frame(
+        "SELECT code, ts, source, estimate_nav, latest_nav, change_pct FROM estimates"
+        f"{where} ORDER BY code, ts",
+        params, 'ts',
+    )
+
+
+def navs_frame(codes=None, start=None, end=None):
+    """查询官方净值，返回 DataFrame[code, date, nav]，按 code、date 排序"""
+    where, params = _where(codes, start, end, 'date')
+    return _query_frame(f"SELECT code, date, nav FROM navs{where} ORDER BY code, date", params, 'date')
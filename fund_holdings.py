@@ -0,0 +1,239 @@
+"""
+持仓 / 业绩基准估值
+- 主动型基金：按最近一期季报披露的前十大重仓股加权估算
+- 持仓不可用的主动型基金、债券型基金：按基准指数组合估算
+  基金配置可设置 benchmark（如 "000300:0.8,000012:0.2" 或 [{"code": "000300", "weight": 0.8}, ...]），
+  未设置时使用 index_code（权重 1），债券型默认使用 BOND_BENCHMARK
+- 持仓按实际披露的报告期缓存到 data/cache/fund_holdings.json，每个季度只需抓取一次；
+  新一期尚未披露（抓到的仍是上一期）时，每隔 HOLDINGS_RETRY_HOURS 重试
+行情由调用方批量获取后传入，这里只负责解析持仓和向量化加权计算
+"""
+
+import json
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+import http_client
+from fund_io import atomic_write_json
+
+HOLDINGS_FILE = os.environ.get("FUND_HOLDINGS_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'cache', 'fund_holdings.json'
+)
+# 季报在季度结束后 15 个工作日内披露，过了这么多天才去抓取新一期持仓
+DISCLOSURE_LAG_DAYS = int(os.environ.get("HOLDINGS_DISCLOSURE_LAG_DAYS", "20"))
+# 新一期尚未披露时的重试间隔（小时）
+RETRY_INTERVAL = timedelta(hours=float(os.environ.get("HOLDINGS_RETRY_HOURS", "12")))
+# 有行情的成分权重占比低于该值时不估算
+MIN_COVERAGE = float(os.environ.get("ESTIMATE_MIN_COVERAGE", "0.6"))
+# 债券型基金未配置基准时使用的指数组合（默认上证国债指数）
+BOND_BENCHMARK = os.environ.get("BOND_BENCHMARK", "000012")
+HOLDINGS_TOP = 10
+
+METHOD_HOLDINGS = 'holdings'    # 前十大重仓股
+METHOD_BENCHMARK = 'benchmark'  # 基准指数组合
+
+# 持仓明细接口（与风险评级页不同域名，可通过环境变量指向桩服务器）
+HOLDINGS_URL = os.environ.get("FUND_HOLDINGS_URL", "https://fundf10.eastmoney.com/FundArchivesDatas.aspx")
+
+
+def resolve_index_secid(code):
+    """
+    指数的东方财富 secid：399 开头为深证指数 (0.)，93 开头或 H 开头的中证指数为 2.，其余为沪市指数 (1.)
+    注意 000 开头的指数与深市股票代码重叠，不能用股票规则判断
+    已带前缀的代码（如 "1.000300"）原样返回
+    """
+    code = str(code).strip()
+    if '.' in code:
+        return code
+    if code.startswith('399'):
+        return f"0.{code}"
+    if code.startswith(('93', 'H')):
+        return f"2.{code}"
+    return f"1.{code}"
+
+
+def parse_mix(value):
+    """
+    解析基准组合，返回 [(secid, weight), ...]
+    支持 "000300:0.8,000012:0.2"、"000300" 或 [{"code": ..., "weight": ...}, ...]
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        items = []
+        for part in value.split(','):
+            code, _, weight = part.strip().partition(':')
+            if code:
+                items.append({'code': code, 'weight': weight or 1})
+        value = items
+    return [(resolve_index_secid(item['code']), float(item.get('weight', 1))) for item in value]
+
+
+def benchmark_mix(fund):
+    """基金的基准指数组合：benchmark > index_code > 债券型默认基准"""
+    if fund.get('benchmark'):
+        return parse_mix(fund['benchmark'])
+    if fund.get('index_code'):
+        return parse_mix(fund['index_code'])
+    if fund.get('type') == 'bond':
+        return parse_mix(BOND_BENCHMARK)
+    return []
+
+
+# ─── 持仓缓存 ─────────────────────────────────────────────
+_lock = threading.RLock()
+_holdings = None  # {code: {'period': 实际报告期, 'holdings': [[secid, name, weight], ...], 'fetched_at'}}
+
+
+def reporting_period(today=None):
+    """当前应已披露的最近一期报告期（季末日期 YYYY-MM-DD）"""
+    today = today or date.today()
+    year, month = today.year, (today.month - 1) // 3 * 3
+    while True:
+        if month == 0:
+            year, month = year - 1, 12
+        quarter_end = date(year, month, 31 if month in (3, 12) else 30)
+        if (today - quarter_end).days >= DISCLOSURE_LAG_DAYS:
+            return quarter_end.isoformat()
+        month -= 3
+
+
+def _load():
+    global _holdings
+    if _holdings is None:
+        _holdings = {}
+        if os.path.exists(HOLDINGS_FILE):
+            try:
+                with open(HOLDINGS_FILE, 'r', encoding='utf-8') as f:
+                    _holdings = json.load(f).get('funds', {})
+            except Exception as e:
+                print(f"⚠️  读取持仓缓存失败: {e}")
+    return _holdings
+
+
+def _save():
+    try:
+        atomic_write_json(HOLDINGS_FILE, {'version': 1, 'funds': _holdings}, ensure_ascii=False, indent=1)
+    except Exception as e:
+        print(f"⚠️  保存持仓缓存失败: {e}")
+
+
+def parse_holdings(text):
+    """
+    解析 F10 持仓明细（jjcc）返回的 HTML 片段，只取最新一期
+    返回 (报告期, [(secid, name, weight_pct), ...])
+    """
+    table = text.split('</table>')[0]
+    match = re.search(r"截止至：\s*(?:<[^>]+>\s*)*(\d{4}-\d{2}-\d{2})", table)
+    report_date = match.group(1) if match else None
+    holdings = []
+    for row in re.findall(r"<tr>(.*?)</tr>", table, re.S):
+        link = re.search(r"unify/r/(\d+\.\w+)", row)
+        cells = [re.sub(r"<[^>]+>", "", cell).strip() for cell in re.findall(r"<td[^>]*>(.*?)</td>", row, re.S)]
+        weight = next((cell[:-1] for cell in cells if re.fullmatch(r"\d+(?:\.\d+)?%", cell)), None)
+        if link and weight and len(cells) > 2:
+            holdings.append((link.group(1), cells[2], float(weight)))
+    return report_date, holdings
+
+
+def _fetch_holdings(fund_code):
+    """抓取前十大重仓股，请求失败抛出异常"""
+    response = http_client.get(
+        "f10", HOLDINGS_URL,
+        params={"type": "jjcc", "code": fund_code, "topline": HOLDINGS_TOP, "year": "", "month": ""},
+    )
+    response.raise_for_status()
+    return parse_holdings(response.text)
+
+
+def _cached_period(entry):
+    """缓存条目的实际报告期（旧版条目的 period 是预期报告期，以 report_date 为准）"""
+    return entry.get('report_date', entry.get('period')) or ''
+
+
+def _is_current(entry, period, now=None):
+    """缓存已是应披露的报告期，或新一期尚未披露且距上次抓取不到 RETRY_INTERVAL"""
+    if _cached_period(entry) >= period:
+        return True
+    fetched_at = entry.get('fetched_at')
+    now = now or datetime.now()
+    return bool(fetched_at) and now - datetime.fromisoformat(fetched_at) < RETRY_INTERVAL
+
+
+def get_holdings(fund_code, fetch=True):
+    """
+    前十大重仓股 [(secid, name, weight_pct), ...]
+    缓存的报告期早于当前应披露的报告期时重新抓取（按 RETRY_INTERVAL 限频；fetch=False 时只读缓存）
+    抓取失败时回退到旧缓存
+    """
+    period = reporting_period()
+    with _lock:
+        entry = _load().get(fund_code)
+    if entry and (not fetch or _is_current(entry, period)):
+        return [tuple(h) for h in entry['holdings']]
+    if not fetch:
+        return []
+
+    try:
+        report_date, holdings = _fetch_holdings(fund_code)
+    except Exception as e:
+        print(f"   ⚠️  获取持仓失败 ({fund_code}): {e}")
+        return [tuple(h) for h in entry['holdings']] if entry else []
+
+    with _lock:
+        # 以页面上的报告期为准：新一期尚未披露时抓到的是上一期，之后继续重试
+        _load()[fund_code] = {
+            'period': report_date,
+            'holdings': [list(h) for h in holdings],
+            'fetched_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        _save()
+    return holdings
+
+
+def reload():
+    """清空内存中的持仓，下次估算时重新读取 HOLDINGS_FILE（外部更新了持仓文件后调用）"""
+    global _holdings
+    with _lock:
+        _holdings = None
+
+
+# ─── 估算 ─────────────────────────────────────────────────
+def components(fund, fetch=True):
+    """
+    估算所用的成分及权重
+    返回 (method, [(secid, weight), ...])；无可用成分时返回 (None, [])
+    """
+    if fund.get('type') == 'active':
+        holdings = get_holdings(fund['code'], fetch=fetch)
+        if holdings:
+            return METHOD_HOLDINGS, [(secid, weight) for secid, _name, weight in holdings]
+    mix = benchmark_mix(fund)
+    if mix:
+        return METHOD_BENCHMARK, mix
+    return None, []
+
+
+def weighted_change(mix, quotes):
+    """
+    成分加权涨跌幅（百分比），按有行情的成分权重归一化
+    quotes: {secid: {'change_pct': ...}}
+    返回 (change_pct, coverage)；覆盖率不足 MIN_COVERAGE 时返回 None
+    """
+    import numpy as np
+
+    if not mix:
+        return None
+    weights = np.fromiter((weight for _secid, weight in mix), dtype=float, count=len(mix))
+    changes = np.fromiter(
+        (quotes[secid]['change_pct'] if secid in quotes else np.nan for secid, _weight in mix),
+        dtype=float, count=len(mix),
+    )
+    quoted = ~np.isnan(changes)
+    total = weights.sum()
+    covered = weights[quoted].sum()
+    if total <= 0 or covered <= 0 or covered / total < MIN_COVERAGE:
+        return None
+    return float(np.dot(weights[quoted], changes[quoted]) / covered), float(covered / total)
@@ -0,0 +1,38 @@
+"""
+数据文件的原子写入
+先在目标目录写唯一命名的临时文件，再 os.replace 替换：读者不会读到写了一半的文件，
+多个进程（定时任务与 Web 服务）同时写同一文件时也不会互相覆盖对方的临时文件
+本模块不依赖任何项目模块
+"""
+
+import json
+import os
+import tempfile
+
+
+def atomic_write(path, data):
+    """原子写入字节内容，目录不存在时自动创建"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        # mkstemp 创建的文件权限为 0600，沿用原文件权限（新文件为 0644）
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, obj, **dump_kwargs):
+    """原子写入 JSON（UTF-8），dump_kwargs 透传给 json.dumps"""
+    atomic_write(path, json.dumps(obj, **dump_kwargs).encode('utf-8'))
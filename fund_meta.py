@@ -0,0 +1,178 @@
+"""
+基金元数据持久化缓存
+保存基金名称、类型、风险评级、ETF映射及各字段的抓取时间，避免每次估值都抓取 F10 页面
+- 有效期长（风险评级一年左右才变动一次）
+- 页面上没有评级的基金做负缓存，较短时间后再重试
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from fund_io import atomic_write_json
+
+META_FILE = os.environ.get("FUND_META_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'cache', 'fund_meta.json'
+)
+
+# 字段有效期
+META_TTL = timedelta(days=int(os.environ.get("FUND_META_TTL_DAYS", "180")))
+# 负缓存有效期（抓取成功但页面没有该字段）
+NEGATIVE_TTL = timedelta(days=int(os.environ.get("FUND_META_NEGATIVE_TTL_DAYS", "7")))
+
+# 可缓存的字段
+META_FIELDS = ('name', 'type', 'risk_level', 'etf_code', 'etf_name')
+
+_lock = threading.RLock()
+_meta = None  # {code: {field: value, ..., 'fetched_at': {field: iso}}}
+_meta_mtime = None  # 上次读取 / 写入时文件的 mtime，变化说明其他进程写过
+_fetch_locks = {}  # (code, field) -> Lock，同一字段同时只抓取一次
+
+
+def _file_mtime():
+    try:
+        return os.stat(META_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_file():
+    """读取磁盘上的元数据，文件不存在或损坏时返回 {}"""
+    if not os.path.exists(META_FILE):
+        return {}
+    try:
+        with open(META_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get('funds', {})
+    except Exception as e:
+        print(f"⚠️  读取基金元数据缓存失败: {e}")
+        return {}
+
+
+def _load():
+    global _meta, _meta_mtime
+    if _meta is None:
+        _meta_mtime = _file_mtime()
+        _meta = _read_file()
+    return _meta
+
+
+def _merge_from_disk():
+    """
+    合并其他进程（定时任务 / Web 服务）写入的字段，避免整体覆盖丢失对方的更新
+    同一字段以 fetched_at 较新的一方为准
+    """
+    for code, disk_entry in _read_file().items():
+        entry = _meta.setdefault(code, {})
+        fetched_at = entry.setdefault('fetched_at', {})
+        for field, disk_time in disk_entry.get('fetched_at', {}).items():
+            if field in disk_entry and disk_time > fetched_at.get(field, ''):
+                entry[field] = disk_entry[field]
+                fetched_at[field] = disk_time
+
+
+def _save():
+    global _meta_mtime
+    try:
+        if _file_mtime() != _meta_mtime:
+            _merge_from_disk()
+        atomic_write_json(META_FILE, {'version': 1, 'funds': _meta}, ensure_ascii=False, indent=1)
+        _meta_mtime = _file_mtime()
+    except Exception as e:
+        print(f"⚠️  保存基金元数据缓存失败: {e}")
+
+
+def get_meta(code):
+    """返回基金元数据的副本，不存在时返回 {}"""
+    with _lock:
+        entry = _load().get(code, {})
+        return {k: v for k, v in entry.items() if k != 'fetched_at'}
+
+
+def lookup(code, field, now=None):
+    """
+    查询缓存字段
+    返回 (是否命中且未过期, 值)；值为 None 表示负缓存
+    """
+    now = now or datetime.now()
+    with _lock:
+        entry = _load().get(code)
+        if not entry or field not in entry:
+            return False, None
+        fetched_at = entry.get('fetched_at', {}).get(field)
+        if not fetched_at:
+            return False, None
+        value = entry[field]
+        ttl = META_TTL if value is not None else NEGATIVE_TTL
+        if now - datetime.fromisoformat(fetched_at) > ttl:
+            return False, value
+        return True, value
+
+
+def update_meta(code, **fields):
+    """写入字段（值为 None 表示负缓存），仅在内容变化时落盘"""
+    now = datetime.now().isoformat(timespec='seconds')
+    with _lock:
+        entry = _load().setdefault(code, {})
+        fetched_at = entry.setdefault('fetched_at', {})
+        changed = False
+        for field, value in fields.items():
+            if field not in META_FIELDS:
+                raise KeyError(f"未知的元数据字段: {field}")
+            if entry.get(field, ...) != value or field not in fetched_at:
+                changed = True
+            entry[field] = value
+            fetched_at[field] = now
+        if changed:
+            _save()
+
+
+def remember_fund(fund, name=None):
+    """记录基金配置中的名称/类型/ETF映射（只在有变化时写盘）"""
+    code = fund.get('code')
+    if not code:
+        return
+    known = get_meta(code)
+    fields = {}
+    for field in ('type', 'etf_code', 'etf_name'):
+        if fund.get(field) and known.get(field) != fund[field]:
+            fields[field] = fund[field]
+    name = name or fund.get('name')
+    if name and known.get('name') != name:
+        fields['name'] = name
+    if fields:
+        update_meta(code, **fields)
+
+
+def get_or_fetch(code, field, fetcher):
+    """
+    读穿缓存：未命中或过期时调用 fetcher() 并写入
+    fetcher 返回 None 表示确认没有该字段（负缓存）；抛出异常表示抓取失败（不缓存）
+    抓取失败时回退到已过期的旧值；同一基金同一字段的并发调用合并为一次抓取
+    """
+    fresh, value = lookup(code, field)
+    if fresh:
+        return value
+    with _lock:
+        fetch_lock = _fetch_locks.setdefault((code, field), threading.Lock())
+    with fetch_lock:
+        # 并发调用方等待同一次抓取，抓取成功后直接读缓存
+        fresh, value = lookup(code, field)
+        if fresh:
+            return value
+        try:
+            new_value = fetcher()
+        except Exception:
+            if value is not None:
+                return value
+            raise
+        update_meta(code, **{field: new_value})
+        return new_value
+
+
+def reload():
+    """丢弃内存中的数据，下次访问时从磁盘重新读取"""
+    global _meta, _meta_mtime
+    with _lock:
+        _meta = None
+        _meta_mtime = None
@@ -0,0 +1,153 @@
+"""
+估值结果模型
+估值计算只产出数值化的 FundEstimate，格式化（保留位数、中文字段名）只在序列化时进行：
+- to_row:  接口 / 维格表使用的中文字段行（字符串，与原有格式一致）
+- to_dict: 数值字段（供服务端排序、汇总）
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from enum import Enum
+from typing import Optional
+
+
+class EstimateSource(str, Enum):
+    """估值来源（取值与 fund_history / fund_accuracy 中的来源一致）"""
+    FUNDGZ = 'fundgz'        # 天天基金网实时估值
+    ETF = 'etf'              # ETF价格计算
+    HOLDINGS = 'holdings'    # 重仓股加权估算
+    BENCHMARK = 'benchmark'  # 基准指数估算
+    NAV = 'nav'              # 昨日净值（无估值）
+
+    @property
+    def label(self):
+        return SOURCE_LABELS[self]
+
+
+SOURCE_LABELS = {
+    EstimateSource.FUNDGZ: '天天基金网',
+    EstimateSource.ETF: 'ETF价格计算',
+    EstimateSource.HOLDINGS: '重仓股估算',
+    EstimateSource.BENCHMARK: '基准指数估算',
+    EstimateSource.NAV: '昨日净值',
+}
+
+# 按行情自行计算的来源（更新时间只显示时分）
+COMPUTED_SOURCES = frozenset({EstimateSource.ETF, EstimateSource.HOLDINGS, EstimateSource.BENCHMARK})
+
+# 基金类型显示名称（etf_linked 附带ETF名称）
+TYPE_LABELS = {
+    'active': '主动型',
+    'bond': '债券型',
+}
+
+
+def type_label(fund):
+    """基金配置的类型显示名称"""
+    fund_type = fund.get('type', '')
+    if fund_type == 'etf_linked':
+        return f"ETF联接-{fund.get('etf_name', '')}"
+    return TYPE_LABELS.get(fund_type, fund_type)
+
+
+@dataclass(slots=True)
+class FundEstimate:
+    """单个基金的估值结果（数值字段，不含任何格式化）"""
+    code: str
+    name: str
+    source: str                               # 用户配置的来源（支付宝、理财通等）
+    risk_level: str
+    fund_type: str
+    latest_nav: float                         # 昨日净值
+    estimate_nav: float                       # 当前估值
+    change_pct: float                         # 涨跌幅（百分比，1.23 表示 1.23%）
+    data_source: EstimateSource
+    estimate_time: Optional[datetime] = None  # 估值时间，无实时估值时为 None
+    nav_date: Optional[date] = None           # 昨日净值对应日期
+    type_label: str = ''
+    note: Optional[str] = None
+
+    @property
+    def change_amount(self):
+        return self.estimate_nav - self.latest_nav
+
+
+def parse_time(value):
+    """解析 "YYYY-MM-DD HH:MM" 格式的估值时间，失败返回 None"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_date(value):
+    """解析 "YYYY-MM-DD" 格式的净值日期，失败返回 None"""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_time(estimate):
+    """更新时间：按行情计算的估值只显示时分，其余显示完整估值时间；无估值时显示净值日期"""
+    if estimate.estimate_time is not None:
+        fmt = '%H:%M' if estimate.data_source in COMPUTED_SOURCES else '%Y-%m-%d %H:%M'
+        return estimate.estimate_time.strftime(fmt)
+    return estimate.nav_date.isoformat() if estimate.nav_date else ''
+
+
+def to_row(estimate):
+    """序列化为中文字段行（接口响应与维格表同步共用）"""
+    row = {
+        "基金名称": estimate.name,
+        "基金代码": estimate.code,
+        "来源": estimate.source,
+        "风险评级": estimate.risk_level,
+        "类型": estimate.type_label,
+        "昨日净值": f"{estimate.latest_nav:.4f}",
+        "当前估值": f"{estimate.estimate_nav:.4f}",
+        "涨跌幅": f"{estimate.change_pct / 100:.4f}",
+        "涨跌额": f"{estimate.change_amount:+.4f}",
+        "更新时间": format_time(estimate),
+        "数据来源": estimate.data_source.label,
+    }
+    if estimate.note:
+        row["备注"] = estimate.note
+    return row
+
+
+def result_row(fund, result):
+    """
+    批量估值结果（FundEstimate、None 或异常）转为响应行（接口、静态快照共用）
+    失败的基金生成占位行：异常为“出错”，无法获取为“获取失败”，并带 error 字段
+    """
+    if isinstance(result, FundEstimate):
+        return to_row(result)
+    return {
+        "基金名称": fund.get('name', fund['code']),
+        "基金代码": fund['code'],
+        "当前估值": "出错" if isinstance(result, Exception) else "获取失败",
+        "涨跌幅": "0",
+        "风险评级": fund.get('risk_level', ''),
+        "error": str(result) if isinstance(result, Exception) else True,
+    }
+
+
+def to_dict(estimate):
+    """序列化为数值字段 dict（JSON 友好）"""
+    return {
+        'code': estimate.code,
+        'name': estimate.name,
+        'source': estimate.source,
+        'risk_level': estimate.risk_level,
+        'type': estimate.fund_type,
+        'type_label': estimate.type_label,
+        'latest_nav': estimate.latest_nav,
+        'estimate_nav': estimate.estimate_nav,
+        'change_pct': estimate.change_pct,
+        'change_amount': estimate.change_amount,
+        'data_source': estimate.data_source.value,
+        'estimate_time': estimate.estimate_time.isoformat() if estimate.estimate_time else None,
+        'nav_date': estimate.nav_date.isoformat() if estimate.nav_date else None,
+        'note': estimate.note,
+    }
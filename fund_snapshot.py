@@ -0,0 +1,115 @@
+"""
+静态估值快照导出
+为 USER_DATA_FILES 中的每个用户跑一遍完整估值（跨用户去重，与快照刷新相同），
+写出紧凑的版本化快照文件，GitHub Pages 等纯静态模式一次请求即可加载，不需要服务端估值：
+- 文件: <输出目录>/estimates_<user>.json，--gzip 时另写一份预压缩的 .json.gz
+- 内容: {version, user, generated_at, expires_at, trading, count, failed, fields, rows}
+  rows 为按 fields 顺序排列的数组（省去每行重复的中文键名），缺失字段为 null；JSON 不带空白
+- expires_at 为下一次估值更新的时间（盘中一个缓存周期，休市时为下一次开盘），供 CDN / 页面判断新鲜度
+- 经 fund_io.atomic_write 写出，读者不会读到写了一半的文件
+
+用法: python fund_snapshot.py [--out data/snapshots] [--user user1 ...] [--gzip]
+"""
+
+import argparse
+import gzip
+import json
+import os
+from datetime import timedelta
+
+if __name__ == "__main__":
+    # 直接运行时先加载 .env，下面导入的模块读取配置时才能拿到其中的值
+    import fund_env
+    fund_env.load_environment()
+
+import fund_cache
+import fund_models
+from fund_io import atomic_write
+import fund_tracker
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR") or os.path.join(fund_tracker.DATA_DIR, 'snapshots')
+
+# 快照行的字段顺序（与接口响应行的字段一致）
+SNAPSHOT_FIELDS = (
+    '基金名称', '基金代码', '来源', '风险评级', '类型', '昨日净值', '当前估值',
+    '涨跌幅', '涨跌额', '更新时间', '数据来源', '备注', 'error',
+)
+
+
+def snapshot_path(user, out_dir=None, compressed=False):
+    return os.path.join(out_dir or SNAPSHOT_DIR, f"estimates_{user}.json{'.gz' if compressed else ''}")
+
+
+def build_snapshot(user, funds, results, now=None):
+    """由估值结果（与 funds 顺序一致）生成快照 dict"""
+    now = now or fund_cache.market_now()
+    rows = [fund_models.result_row(fund, res) for fund, res in zip(funds, results)]
+    return {
+        'version': SNAPSHOT_VERSION,
+        'user': user,
+        'generated_at': now.isoformat(timespec='seconds'),
+        'expires_at': (now + timedelta(seconds=fund_cache.market_ttl(now))).isoformat(timespec='seconds'),
+        'trading': fund_cache.is_trading_time(now),
+        'count': len(rows),
+        'failed': sum(1 for row in rows if row.get('error')),
+        'fields': list(SNAPSHOT_FIELDS),
+        'rows': [[row.get(field) for field in SNAPSHOT_FIELDS] for row in rows],
+    }
+
+
+def encode_snapshot(snapshot):
+    """紧凑 JSON（UTF-8，无空白）"""
+    return json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_snapshot(snapshot, out_dir=None, compress=False):
+    """写出快照文件，返回写入的路径列表（mtime 固定为 0，内容相同时 .gz 字节一致）"""
+    data = encode_snapshot(snapshot)
+    path = snapshot_path(snapshot['user'], out_dir)
+    atomic_write(path, data)
+    paths = [path]
+    if compress:
+        gz_path = snapshot_path(snapshot['user'], out_dir, compressed=True)
+        atomic_write(gz_path, gzip.compress(data, compresslevel=9, mtime=0))
+        paths.append(gz_path)
+    return paths
+
+
+def export_snapshots(out_dir=None, users=None, compress=False):
+    """
+    导出指定用户（默认 USER_DATA_FILES 中的全部用户）的估值快照
+    返回 {user: [写入的路径, ...]}
+    """
+    user_files = {user: path for user, path in fund_tracker.USER_DATA_FILES.items() if not users or user in users}
+    user_funds = {user: fund_tracker.load_funds(path) for user, path in user_files.items()}
+    now = fund_cache.market_now()
+    estimates = fund_tracker.calculate_user_estimates(user_funds, return_exceptions=True)
+
+    written = {}
+    for user, funds in user_funds.items():
+        snapshot = build_snapshot(user, funds, estimates[user], now)
+        written[user] = write_snapshot(snapshot, out_dir, compress)
+        sizes = " / ".join(f"{os.path.getsize(p) / 1024:.1f}KB" for p in written[user])
+        print(f"📸 {user}: {snapshot['count']} 个基金（失败 {snapshot['failed']}）→ "
+              f"{', '.join(os.path.basename(p) for p in written[user])} ({sizes})")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出静态估值快照")
+    parser.add_argument('--out', default=None, help=f"输出目录（默认 {SNAPSHOT_DIR}）")
+    parser.add_argument('--user', action='append', default=[],
+                        help=f"只导出指定用户（可重复），可选: {', '.join(fund_tracker.USER_DATA_FILES)}")
+    parser.add_argument('--gzip', action='store_true', help="另写一份预压缩的 .json.gz")
+    args = parser.parse_args()
+
+    unknown = set(args.user) - set(fund_tracker.USER_DATA_FILES)
+    if unknown:
+        parser.error(f"未知用户: {', '.join(sorted(unknown))}")
+    export_snapshots(args.out, args.user, args.gzip)
+    print("✅ 快照导出完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+基金列表存储
+- 内存中维护基金列表和 代码→基金 索引，读取不触碰磁盘（仅按间隔检查文件 mtime）
+- 每个文件一把锁，修改在锁内完成，避免后台线程覆盖刚添加的基金（丢失更新）
+- 跨进程（定时任务与 Web 服务）用 fcntl.flock 锁住旁路的 .lock 文件，修改前重新读取磁盘上的最新数据；
+  没有 fcntl 的平台（Windows）只保证单进程内不丢失更新
+- JSON 后端：写临时文件后原子替换；可选 SQLite 后端（FUND_STORE_BACKEND=sqlite）
+"""
+
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from fund_io import atomic_write_json
+
+# 后端：json（默认）或 sqlite
+FUND_STORE_BACKEND = os.environ.get("FUND_STORE_BACKEND", "json").strip().lower()
+FUND_STORE_DB = os.environ.get("FUND_STORE_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'funds.db'
+)
+# 两次检查文件是否被外部修改的最小间隔（秒）
+RELOAD_CHECK_INTERVAL = float(os.environ.get("FUND_STORE_RELOAD_INTERVAL", "1"))
+
+
+@contextmanager
+def _file_lock(path):
+    """跨进程排他锁（flock 旁路锁文件）；没有 fcntl 时不加锁"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class FundStore(abc.ABC):
+    """带索引和锁的基金列表，子类实现 _mtime / _read / _write / _lock_path"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._funds = None      # [fund, ...]，保持文件中的顺序
+        self._index = {}        # code -> fund
+        self._loaded_mtime = None
+        self._checked_at = 0.0
+
+    # ─── 后端接口 ─────────────────────────────────────────
+    @abc.abstractmethod
+    def _mtime(self):
+        """存储的修改时间（用于判断是否被外部修改），不存在时返回 None"""
+
+    @abc.abstractmethod
+    def _read(self):
+        """读取基金列表"""
+
+    @abc.abstractmethod
+    def _write(self, funds):
+        """写入基金列表，成功返回 True"""
+
+    @abc.abstractmethod
+    def _lock_path(self):
+        """跨进程锁文件路径"""
+
+    # ─── 内部 ─────────────────────────────────────────────
+    def _ensure_loaded(self, force=False):
+        """首次访问或外部修改过文件时重新加载；force 时忽略检查间隔"""
+        now = time.monotonic()
+        if not force and self._funds is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        mtime = self._mtime()
+        if self._funds is None or mtime != self._loaded_mtime:
+            self._set(self._read())
+            self._loaded_mtime = mtime
+
+    @contextmanager
+    def _modifying(self):
+        """修改的临界区：进程内锁 + 跨进程文件锁，进入时基于磁盘上的最新数据"""
+        with self._lock, _file_lock(self._lock_path()):
+            self._ensure_loaded(force=True)
+            yield
+
+    def _set(self, funds):
+        self._funds = list(funds)
+        self._index = {fund.get('code'): fund for fund in self._funds}
+
+    def _commit(self, funds):
+        if not self._write(funds):
+            return False
+        self._set(funds)
+        self._loaded_mtime = self._mtime()
+        self._checked_at = time.monotonic()
+        return True
+
+    # ─── 读 ───────────────────────────────────────────────
+    def list(self):
+        """全部基金（副本，调用方修改不影响存储）"""
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(fund) for fund in self._funds]
+
+    def get(self, code):
+        with self._lock:
+            self._ensure_loaded()
+            fund = self._index.get(code)
+            return dict(fund) if fund else None
+
+    def __contains__(self, code):
+        with self._lock:
+            self._ensure_loaded()
+            return code in self._index
+
+    # ─── 写 ───────────────────────────────────────────────
+    def add(self, fund):
+        """新增基金；代码已存在返回 False"""
+        with self._modifying():
+            if fund['code'] in self._index:
+                return False
+            return self._commit(self._funds + [dict(fund)])
+
+    def delete(self, code):
+        """删除基金；不存在返回 False"""
+        with self._modifying():
+            if code not in self._index:
+                return False
+            return self._commit([f for f in self._funds if f.get('code') != code])
+
+    def update_many(self, updates):
+        """
+        批量合并字段 {code: {field: value}}，在锁内基于最新数据修改
+        返回实际更新的基金数（已被删除的基金忽略）
+        """
+        with self._modifying():
+            funds = []
+            updated = 0
+            for fund in self._funds:
+                fields = updates.get(fund.get('code'))
+                if fields:
+                    fund = {**fund, **fields}
+                    updated += 1
+                funds.append(fund)
+            if updated and not self._commit(funds):
+                return 0
+            return updated
+
+    def replace(self, funds):
+        """整体替换基金列表"""
+        with self._modifying():
+            return self._commit([dict(f) for f in funds])
+
+
+class JsonFundStore(FundStore):
+    """JSON 文件后端（格式与 data/funds*.json 一致）"""
+
+    def __init__(self, data_file):
+        super().__init__()
+        self.data_file = data_file
+
+    def _lock_path(self):
+        return f"{self.data_file}.lock"
+
+    def _mtime(self):
+        try:
+            return os.stat(self.data_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Failed to load funds: {e}")
+        return []
+
+    def _write(self, funds):
+        try:
+            atomic_write_json(self.data_file, funds, ensure_ascii=False, indent=2)
+            return True
+        except Exception as e:
+            print(f"Failed to save funds: {e}")
+            return False
+
+
+class SqliteFundStore(FundStore):
+    """
+    SQLite 后端：所有列表存在同一个库中，按 JSON 文件名区分
+    首次使用时从同名 JSON 文件导入一次（导入记录在 store_meta 表中，列表删空后不会再次导入）
+    """
+
+    def __init__(self, db_file, data_file):
+        super().__init__()
+        self.db_file = db_file
+        self.data_file = data_file
+        self.namespace = os.path.basename(data_file)
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        # 多个进程同时首次打开时只导入一次
+        with _file_lock(self._lock_path()), self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS funds ("
+                " namespace TEXT NOT NULL, code TEXT NOT NULL, position INTEGER NOT NULL,"
+                " data TEXT NOT NULL, PRIMARY KEY (namespace, code))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS store_meta ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            imported = conn.execute(
+                "SELECT 1 FROM store_meta WHERE namespace = ? AND key = 'json_imported'", (self.namespace,)
+            ).fetchone()
+            if not imported:
+                # 已有数据的旧库视为导入过，只补记录
+                exists = conn.execute(
+                    "SELECT 1 FROM funds WHERE namespace = ? LIMIT 1", (self.namespace,)
+                ).fetchone()
+                if not exists:
+                    self._insert(conn, JsonFundStore(data_file).list())
+                conn.execute(
+                    "INSERT INTO store_meta (namespace, key, value) VALUES (?, 'json_imported', ?)",
+                    (self.namespace, time.strftime('%Y-%m-%dT%H:%M:%S')),
+                )
+
+    def _connect(self):
+        """用法: with self._connect() as conn —— 退出时提交事务并关闭连接"""
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        return _Transaction(conn)
+
+    def _lock_path(self):
+        return f"{self.db_file}.lock"
+
+    def _mtime(self):
+        try:
+            return os.stat(self.db_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT data FROM funds WHERE namespace = ? ORDER BY position", (self.namespace,)
+                ).fetchall()
+            return [json.loads(row[0]) for row in rows]
+        except Exception as e:
+            print(f"Failed to load funds: {e}")
+            return []
+
+    def _write(self, funds):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM funds WHERE namespace = ?", (self.namespace,))
+                self._insert(conn, funds)
+            return True
+        except Exception as e:
+            print(f"Failed to save funds: {e}")
+            return False
+
+    def _insert(self, conn, funds):
+        conn.executemany(
+            "INSERT INTO funds (namespace, code, position, data) VALUES (?, ?, ?, ?)",
+            [(self.namespace, f.get('code'), i, json.dumps(f, ensure_ascii=False))
+             for i, f in enumerate(funds)],
+        )
+
+
+class _Transaction:
+    """sqlite3 连接的 with 语义只管事务不关连接，这里两者都处理"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return self.conn.__exit__(*exc)
+        finally:
+            self.conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(data_file):
+    """每个数据文件共享一个存储实例（即共享同一把锁）"""
+    data_file = os.path.abspath(data_file)
+    with _stores_lock:
+        store = _stores.get(data_file)
+        if store is None:
+            if FUND_STORE_BACKEND == 'sqlite':
+                store = SqliteFundStore(FUND_STORE_DB, data_file)
+            else:
+                store = JsonFundStore(data_file)
+            _stores[data_file] = store
+        return store
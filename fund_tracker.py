@@ -1,200 +1,547 @@
 """
 基金实时估值追踪工具
 优先使用天天基金网实时估值，备用 AkShare 数据
+导入本模块不做任何 I/O：.env 由入口经 fund_env 在导入项目模块之前加载，维格表配置和基金列表经 get_context() 在首次使用时读取
 """
 
 import os
-import requests
+import re
+import threading
+import time
 import json
-import pandas as pd
+from dataclasses import replace
 from datetime import datetime
-import urllib3
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
-# 加载 .env 文件（本地开发使用，GitHub Actions 不需要）
-load_dotenv(verbose=False)
+if __name__ == "__main__":
+    # 直接运行时先加载 .env，下面导入的模块读取配置时才能拿到其中的值
+    import fund_env
+    fund_env.load_environment()
 
-# 禁用 SSL 警告（仅用于解决某些网络环境的证书问题）
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import fund_accuracy
+import fund_cache
+import fund_history
+import fund_holdings
+import fund_meta
+import fund_store
+import http_client
+import metrics
+import vika_sync
+from fund_env import load_environment
+from fund_cache import MARKET_TZ, estimate_cache
+from fund_models import EstimateSource, FundEstimate, parse_date, parse_time, to_row, type_label
 
-# 配置信息（优先从环境变量读取，其次从 .env 文件读取）
-VIKA_API_TOKEN = os.environ.get("VIKA_API_TOKEN", "").strip()
-VIKA_DATASHEET_ID = os.environ.get("VIKA_DATASHEET_ID", "").strip()
-VIKA_API_BASE = "https://vika.cn/fusion/v1"
+# 批量估值并发配置
+ESTIMATE_MAX_WORKERS = int(os.environ.get("ESTIMATE_MAX_WORKERS", "8"))
+ESTIMATE_BATCH_TIMEOUT = float(os.environ.get("ESTIMATE_BATCH_TIMEOUT", "20"))
+# 同步批量接口的实现：async（fund_async 异步流水线，默认）或 threads（线程池逐只估值）
+ESTIMATE_PIPELINE = os.environ.get("ESTIMATE_PIPELINE", "async").strip().lower()
+# 单个上游的并发上限、超时和重试策略见 http_client.UPSTREAMS
+# 上游熔断器健康分低于该值（窗口内失败和慢调用比例超过 30%，或熔断中）时跳过依赖它的估值方案
+UPSTREAM_MIN_HEALTH = float(os.environ.get("UPSTREAM_MIN_HEALTH", "0.7"))
 
 # 基金数据文件路径
-DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'funds.json')
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DATA_FILE = os.path.join(DATA_DIR, 'funds.json')
+
+# 用户数据文件映射（Flask 接口和静态快照导出共用）
+USER_DATA_FILES = {
+    'user1': DATA_FILE,
+    'user2': os.path.join(DATA_DIR, 'funds_user2.json'),
+}
 
 def load_funds(data_file=None):
+    """读取基金列表（经 fund_store 缓存，文件未变化时不读盘）"""
     if data_file is None:
         data_file = DATA_FILE
-    if os.path.exists(data_file):
-        try:
-            with open(data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Failed to load funds: {e}")
-            return []
-    return []
+    return fund_store.get_store(data_file).list()
 
 def save_funds(funds, data_file=None):
+    """整体保存基金列表（原子写入）"""
     if data_file is None:
         data_file = DATA_FILE
+    return fund_store.get_store(data_file).replace(funds)
+
+# 数据文件不存在或为空时使用的默认基金列表
+DEFAULT_FUNDS = (
+    # 理财通基金
+    {
+        "name": "易方达黄金ETF联接C",
+        "code": "002963",
+        "type": "etf_linked",
+        "etf_code": "159934",
+        "etf_name": "黄金ETF",
+        "source": "理财通"
+    },
+    {
+        "name": "汇添富有色金属ETF",
+        "code": "019165",
+        "type": "etf_linked",
+        "etf_code": "512400",
+        "etf_name": "有色金属ETF",
+        "source": "理财通"
+    },
+    {
+        "name": "南方信息创新混合A",
+        "code": "007490",
+        "type": "active",
+        "index_code": "399006",
+        "index_name": "创业板指",
+        "source": "理财通"
+    },
+    {
+        "name": "国联安半导体ETF联接A",
+        "code": "007300",
+        "type": "etf_linked",
+        "etf_code": "512480",
+        "etf_name": "半导体ETF",
+        "source": "理财通"
+    },
+    {
+        "name": "博时转债增强债券A",
+        "code": "050019",
+        "type": "bond",
+        "index_code": "000832",
+        "index_name": "中证转债",
+        "source": "理财通"
+    },
+    {
+        "name": "易方达科创50ETF联接C",
+        "code": "013305",
+        "type": "etf_linked",
+        "etf_code": "588000",
+        "etf_name": "科创50ETF",
+        "source": "理财通"
+    },
+    # 支付宝基金
+    {
+        "name": "国寿安保尊享债券A",
+        "code": "000668",
+        "type": "bond",
+        "source": "支付宝"
+    },
+    {
+        "name": "富国稳健添息债券C",
+        "code": "019584",
+        "type": "bond",
+        "source": "支付宝"
+    },
+    {
+        "name": "汇添富鑫享添利六个月持有期混合A",
+        "code": "012951",
+        "type": "bond",
+        "source": "支付宝"
+    },
+    {
+        "name": "上银慧享利30天滚动持有中短债债券A",
+        "code": "015942",
+        "type": "bond",
+        "source": "支付宝"
+    },
+)
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+class TrackerContext:
+    """运行上下文：维格表配置和基金列表在访问时读取（优先环境变量，其次 .env 文件）"""
+
+    def __init__(self, data_file=None):
+        self.data_file = data_file or DATA_FILE
+
+    @property
+    def vika_api_token(self):
+        return os.environ.get("VIKA_API_TOKEN", "").strip()
+
+    @property
+    def vika_datasheet_id(self):
+        return os.environ.get("VIKA_DATASHEET_ID", "").strip()
+
+    @property
+    def funds(self):
+        """基金列表（经 fund_store 缓存，文件变化后自动重新读取），文件不存在或为空时使用默认列表"""
+        return load_funds(self.data_file) or [dict(fund) for fund in DEFAULT_FUNDS]
+
+
+def get_context():
+    """默认运行上下文（首次调用时加载 .env）"""
+    global _context
+    load_environment()
+    with _context_lock:
+        if _context is None:
+            _context = TrackerContext()
+        return _context
+
+
+# 兼容旧代码的模块属性，访问时经 get_context() 读取
+_CONTEXT_ATTRS = {
+    'FUNDS': 'funds',
+    'VIKA_API_TOKEN': 'vika_api_token',
+    'VIKA_DATASHEET_ID': 'vika_datasheet_id',
+}
+
+
+def __getattr__(name):
+    if name in _CONTEXT_ATTRS:
+        return getattr(get_context(), _CONTEXT_ATTRS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# fundgz 失败原因
+FUNDGZ_ERROR_NETWORK = 'network'            # 网络错误或非 200 响应
+FUNDGZ_ERROR_INVALID_CODE = 'invalid_code'  # 返回内容无法解析（多为无效代码）
+FUNDGZ_ERROR_NO_ESTIMATE = 'no_estimate'    # 有净值但暂无实时估值 (gsz 为空)
+
+
+def fetch_fundgz(fund_code, use_cache=True):
+    """
+    获取并解析天天基金网 jsonpgz 数据（每只基金每轮刷新只请求一次）
+    注意：此API可能随时失效（监管要求）
+    返回: {'success': True, 'payload': {...}}
+          或 {'success': False, 'reason': FUNDGZ_ERROR_*, 'error': 说明}
+    成功结果按交易时段缓存，失败结果不缓存
+    """
+    if not use_cache:
+        return _fetch_fundgz(fund_code)
+    return estimate_cache.get_or_load(
+        f"fundgz:{fund_code}",
+        lambda: _fetch_fundgz(fund_code),
+        cacheable=lambda result: result['success'],
+    )
+
+
+def _fetch_fundgz(fund_code):
     try:
-        os.makedirs(os.path.dirname(data_file), exist_ok=True)
-        with open(data_file, 'w', encoding='utf-8') as f:
-            json.dump(funds, f, ensure_ascii=False, indent=2)
-        return True
+        response = http_client.get("fundgz", f"/js/{fund_code}.js")
     except Exception as e:
-        print(f"Failed to save funds: {e}")
-        return False
+        return _fundgz_request_failed(e)
+    return _parse_fundgz(fund_code, response)
 
-# 初始化配置
-FUNDS = load_funds()
-if not FUNDS:
-    # Fallback default if file doesn't exist or is empty
-    FUNDS = [
-        # 理财通基金
-        {
-            "name": "易方达黄金ETF联接C",
-            "code": "002963",
-            "type": "etf_linked",
-            "etf_code": "159934",
-            "etf_name": "黄金ETF",
-            "source": "理财通"
-        },
-        {
-            "name": "汇添富有色金属ETF",
-            "code": "019165",
-            "type": "etf_linked",
-            "etf_code": "512400",
-            "etf_name": "有色金属ETF",
-            "source": "理财通"
-        },
-        {
-            "name": "南方信息创新混合A",
-            "code": "007490",
-            "type": "active",
-            "index_code": "399006",
-            "index_name": "创业板指",
-            "source": "理财通"
-        },
-        {
-            "name": "国联安半导体ETF联接A",
-            "code": "007300",
-            "type": "etf_linked",
-            "etf_code": "512480",
-            "etf_name": "半导体ETF",
-            "source": "理财通"
-        },
-        {
-            "name": "博时转债增强债券A",
-            "code": "050019",
-            "type": "bond",
-            "index_code": "000832",
-            "index_name": "中证转债",
-            "source": "理财通"
-        },
-        {
-            "name": "易方达科创50ETF联接C",
-            "code": "013305",
-            "type": "etf_linked",
-            "etf_code": "588000",
-            "etf_name": "科创50ETF",
-            "source": "理财通"
-        },
-        # 支付宝基金
-        {
-            "name": "国寿安保尊享债券A",
-            "code": "000668",
-            "type": "bond",
-            "source": "支付宝"
-        },
-        {
-            "name": "富国稳健添息债券C",
-            "code": "019584",
-            "type": "bond",
-            "source": "支付宝"
-        },
-        {
-            "name": "汇添富鑫享添利六个月持有期混合A",
-            "code": "012951",
-            "type": "bond",
-            "source": "支付宝"
-        },
-        {
-            "name": "上银慧享利30天滚动持有中短债债券A",
-            "code": "015942",
-            "type": "bond",
-            "source": "支付宝"
-        },
-    ]
-    # save_funds(FUNDS) # Optional: create file if missing
-
-
-def get_fund_realtime_data(fund_code):
-    """
-    从天天基金网获取基金数据
-    注意：此API可能随时失效（监管要求）
-    返回: dict with fund data
+
+def _fundgz_request_failed(error):
+    """jsonpgz 请求异常时的失败结果"""
+    if not isinstance(error, http_client.CircuitOpenError):
+        print(f"⚠️  天天基金网获取失败: {error}")
+    # 熔断中不发请求，直接进入备用方案
+    return {'success': False, 'reason': FUNDGZ_ERROR_NETWORK, 'error': str(error)}
+
+
+def _parse_fundgz(fund_code, response):
+    """解析 jsonpgz 响应"""
+    if response.status_code != 200 or not response.text:
+        return {'success': False, 'reason': FUNDGZ_ERROR_NETWORK, 'error': f'HTTP {response.status_code}'}
+    
+    # 检查返回内容是否有效
+    if 'jsonpgz(' not in response.text and '(' not in response.text:
+        print(f"⚠️  基金 {fund_code} 返回内容异常，可能是无效代码")
+        return {'success': False, 'reason': FUNDGZ_ERROR_INVALID_CODE, 'error': '基金代码可能无效'}
+    
+    # 解析返回的 JavaScript 数据
+    try:
+        json_str = response.text.split('(')[1].split(')')[0]
+        data = json.loads(json_str)
+        data['name'], float(data['dwjz'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        print(f"⚠️  基金 {fund_code} 数据解析失败: {response.text[:100]}")
+        return {'success': False, 'reason': FUNDGZ_ERROR_INVALID_CODE, 'error': '数据格式错误'}
+    
+    return {'success': True, 'payload': data}
+
+
+# 移动端多基金估值接口：每次请求的基金数量，FUNDGZ_BATCH=0 时关闭批量预取
+FUNDGZ_BATCH = os.environ.get("FUNDGZ_BATCH", "1") == "1"
+FUNDGZ_BATCH_SIZE = int(os.environ.get("FUNDGZ_BATCH_SIZE", "50"))
+FUNDMOB_PATH = "/FundMNewApi/FundMNFInfo"
+
+
+def prefetch_fundgz(fund_codes, use_cache=True):
     """
+    批量预取估值（天天基金移动端 FundMNFInfo 接口，Fcodes 逗号分隔，按 FUNDGZ_BATCH_SIZE 分批）
+    结果转换为 jsonpgz 的 payload 格式写入 fetch_fundgz 的缓存，之后逐只估值直接命中；
+    接口失败、未返回或没有可用估值的基金不写缓存，仍走单只 jsonpgz 请求
+    返回: {fund_code: fetch_fundgz 结果}（只含本次批量获取成功的基金）
+    """
+    codes = [c for c in dict.fromkeys(fund_codes) if c]
+    if use_cache:
+        codes = [c for c in codes if not estimate_cache.peek(f"fundgz:{c}")[0]]
+    results = {}
+    for chunk in _fundgz_chunks(codes):
+        _store_fundgz(results, _fetch_fundgz_batch(chunk), use_cache)
+    return results
+
+
+def _fundgz_chunks(codes):
+    return [codes[i:i + FUNDGZ_BATCH_SIZE] for i in range(0, len(codes), FUNDGZ_BATCH_SIZE)]
+
+
+def _store_fundgz(results, fetched, use_cache=True):
+    for code, result in fetched.items():
+        results[code] = result
+        if use_cache:
+            estimate_cache.put(f"fundgz:{code}", result)
+
+
+def _fundmob_params(codes):
+    return {
+        "Fcodes": ",".join(codes),
+        "pageIndex": 1,
+        "pageSize": len(codes),
+        "plat": "Android",
+        "appType": "ttjj",
+        "product": "EFund",
+        "Version": "1",
+        "deviceid": "fund-tracker",
+    }
+
+
+def _fetch_fundgz_batch(codes):
+    """一次 FundMNFInfo 请求获取多只基金的估值，失败返回 {}"""
     try:
-        url = f"http://fundgz.1234567.com.cn/js/{fund_code}.js"
-        response = requests.get(url, timeout=10)
+        response = http_client.get("fundmob", FUNDMOB_PATH, params=_fundmob_params(codes))
+        return _parse_fundmob(response)
+    except Exception as e:
+        if not isinstance(e, http_client.CircuitOpenError):
+            print(f"⚠️  批量获取估值失败: {e}")
+        return {}
+
+
+def _parse_fundmob(response):
+    """
+    解析 FundMNFInfo 响应，转换为 {fund_code: {'success': True, 'payload': jsonpgz 格式}}
+    只保留有实时估值、且估值日期晚于净值日期的基金（收盘后净值已公布时交给 jsonpgz 判断）
+    """
+    if response.status_code != 200:
+        return {}
+    results = {}
+    for item in response.json().get('Datas') or []:
+        code = item.get('FCODE')
+        nav_date = item.get('PDATE') or ''
+        gztime = item.get('GZTIME') or ''
+        try:
+            float(item['NAV']), float(item['GSZ'])
+        except (KeyError, TypeError, ValueError):
+            continue  # 无估值时为 "--"
+        if not code or not item.get('SHORTNAME') or not gztime or gztime[:10] <= nav_date:
+            continue
+        results[code] = {'success': True, 'payload': {
+            'fundcode': code,
+            'name': item['SHORTNAME'],
+            'jzrq': nav_date,
+            'dwjz': item['NAV'],
+            'gsz': item['GSZ'],
+            'gszzl': item.get('GSZZL', ''),
+            'gztime': gztime,
+        }}
+    return results
+
+
+def get_fund_realtime_data(fund_code, use_cache=True, fundgz=None):
+    """
+    从天天基金网获取基金实时估值
+    fundgz: 已获取的 fetch_fundgz 结果，传入时不再请求
+    返回: dict with fund data；失败时带 reason
+    """
+    if fundgz is None:
+        fundgz = fetch_fundgz(fund_code, use_cache)
+    if not fundgz['success']:
+        return {'success': False, 'reason': fundgz['reason'], 'error': fundgz['error']}
+    
+    data = fundgz['payload']
+    fund_name = data['name']              # 基金名称
+    latest_nav = float(data['dwjz'])      # 昨日净值
+    estimate_nav = data.get('gsz', None)  # 实时估值（可能为空）
+    estimate_time = data.get('gztime', '') # 估值时间
+    
+    if estimate_nav and estimate_nav != '':
+        estimate_nav = float(estimate_nav)
+        change_pct = (estimate_nav - latest_nav) / latest_nav * 100
+        change_amount = estimate_nav - latest_nav
         
-        if response.status_code == 200 and response.text:
-            # 检查返回内容是否有效
-            if 'jsonpgz(' not in response.text and '(' not in response.text:
-                print(f"⚠️  基金 {fund_code} 返回内容异常，可能是无效代码")
-                return {'success': False, 'error': '基金代码可能无效'}
-            
-            # 解析返回的 JavaScript 数据
-            try:
-                json_str = response.text.split('(')[1].split(')')[0]
-                data = json.loads(json_str)
-            except (IndexError, json.JSONDecodeError) as e:
-                print(f"⚠️  基金 {fund_code} 数据解析失败: {response.text[:100]}")
-                return {'success': False, 'error': '数据格式错误'}
-            
-            fund_name = data['name']              # 基金名称
-            latest_nav = float(data['dwjz'])      # 昨日净值
-            estimate_nav = data.get('gsz', None)  # 实时估值（可能为空）
-            estimate_time = data.get('gztime', '') # 估值时间
+        return {
+            'fund_name': fund_name,
+            'latest_nav': latest_nav,
+            'estimate_nav': estimate_nav,
+            'change_pct': change_pct,
+            'change_amount': change_amount,
+            'estimate_time': estimate_time,
+            'success': True,
+            'data_source': EstimateSource.FUNDGZ
+        }
+    
+    # 没有实时估值，返回昨日净值
+    return {
+        'fund_name': fund_name,
+        'latest_nav': latest_nav,
+        'estimate_nav': latest_nav,
+        'change_pct': 0.0,
+        'change_amount': 0.0,
+        'estimate_time': data.get('jzrq', ''),
+        'success': True,
+        'reason': FUNDGZ_ERROR_NO_ESTIMATE,
+        'note': '暂无实时估值',
+        'data_source': EstimateSource.FUNDGZ
+    }
+
+
+# 单次 ulist 请求最多携带的证券数量
+ETF_QUOTE_CHUNK_SIZE = int(os.environ.get("ETF_QUOTE_CHUNK_SIZE", "50"))
+
+
+def resolve_secid(code):
+    """
+    东方财富 secid：沪市前缀 1.，深市前缀 0.
+    沪市基金/股票以 5、6、9 开头（如 512400、588000），深市以 0、1、2、3 开头（如 159934）
+    已带前缀的代码（如 "0.159934"）原样返回
+    """
+    code = str(code).strip()
+    if '.' in code:
+        return code
+    market = '1' if code[:1] in ('5', '6', '9') else '0'
+    return f"{market}.{code}"
+
+
+def get_etf_quote(etf_code, use_cache=True):
+    """
+    获取ETF实时行情（东方财富，带缓存）
+    返回: {'price', 'prev_close', 'change_pct'}，失败返回 None
+    """
+    if not use_cache:
+        return _fetch_etf_quote(etf_code)
+    return estimate_cache.get_or_load(
+        f"etf:{etf_code}",
+        lambda: _fetch_etf_quote(etf_code),
+        cacheable=lambda quote: quote is not None,
+    )
+
+
+def _etf_quote_params(etf_code):
+    return {"secid": resolve_secid(etf_code), "fields": "f43,f44,f45,f46,f60,f170"}
+
+
+def _fetch_etf_quote(etf_code):
+    try:
+        response = http_client.get("push2", "/api/qt/stock/get", params=_etf_quote_params(etf_code))
+        return _parse_etf_quote(response)
+    except Exception:
+        return None
+
+
+def _parse_etf_quote(response):
+    """解析 stock/get 单只证券行情，无有效行情返回 None"""
+    if response.status_code == 200:
+        data = response.json()
+        if data.get('data'):
+            current_price = data['data'].get('f43')  # 当前价
+            yesterday_close = data['data'].get('f60')  # 昨收
             
-            if estimate_nav and estimate_nav != '':
-                estimate_nav = float(estimate_nav)
-                change_pct = (estimate_nav - latest_nav) / latest_nav * 100
-                change_amount = estimate_nav - latest_nav
-                
-                return {
-                    'fund_name': fund_name,
-                    'latest_nav': latest_nav,
-                    'estimate_nav': estimate_nav,
-                    'change_pct': change_pct,
-                    'change_amount': change_amount,
-                    'estimate_time': estimate_time,
-                    'success': True,
-                    'data_source': '天天基金网'
-                }
-            else:
-                # 没有实时估值，返回昨日净值
+            if current_price and yesterday_close:
+                current_price = float(current_price) / 1000
+                yesterday_close = float(yesterday_close) / 1000
                 return {
-                    'fund_name': fund_name,
-                    'latest_nav': latest_nav,
-                    'estimate_nav': latest_nav,
-                    'change_pct': 0.0,
-                    'change_amount': 0.0,
-                    'estimate_time': data.get('jzrq', ''),
-                    'success': True,
-                    'note': '暂无实时估值',
-                    'data_source': '天天基金网'
+                    'price': current_price,
+                    'prev_close': yesterday_close,
+                    'change_pct': (current_price - yesterday_close) / yesterday_close * 100,
                 }
-        else:
-            return {'success': False}
-            
+    return None
+
+
+def get_etf_quotes(etf_codes, use_cache=True):
+    """
+    批量获取ETF实时行情（东方财富 ulist 多证券接口）
+    相同代码只请求一次，未缓存的代码按 ETF_QUOTE_CHUNK_SIZE 分批请求
+    返回: {etf_code: quote}，获取失败的代码不在结果中
+    """
+    return _get_quotes(etf_codes, "etf", use_cache)
+
+
+def get_quotes(secids, use_cache=True, cached_only=False):
+    """
+    批量获取股票/指数实时行情（按 secid，如 "1.600519"、"0.399006"）
+    cached_only=True 时只返回已缓存的行情，不发请求
+    返回: {secid: quote}，获取失败的不在结果中
+    """
+    return _get_quotes(secids, "quote", use_cache, cached_only)
+
+
+def _get_quotes(codes, cache_prefix, use_cache=True, cached_only=False):
+    quotes, missing = _cached_quotes(codes, cache_prefix, use_cache)
+    if cached_only:
+        return quotes
+    
+    for chunk in _quote_chunks(missing):
+        _store_quotes(quotes, _fetch_quotes(chunk), cache_prefix, use_cache)
+    return quotes
+
+
+def _cached_quotes(codes, cache_prefix, use_cache=True):
+    """去重并查缓存，返回 (已缓存的行情, 需要请求的代码)"""
+    quotes = {}
+    missing = []
+    for code in dict.fromkeys(c for c in codes if c):
+        if use_cache:
+            hit, quote = estimate_cache.peek(f"{cache_prefix}:{code}")
+            if hit:
+                quotes[code] = quote
+                continue
+        missing.append(code)
+    return quotes, missing
+
+
+def _quote_chunks(codes):
+    """按 ETF_QUOTE_CHUNK_SIZE 分批"""
+    return [codes[i:i + ETF_QUOTE_CHUNK_SIZE] for i in range(0, len(codes), ETF_QUOTE_CHUNK_SIZE)]
+
+
+def _store_quotes(quotes, fetched, cache_prefix, use_cache=True):
+    for code, quote in fetched.items():
+        quotes[code] = quote
+        if use_cache:
+            estimate_cache.put(f"{cache_prefix}:{code}", quote)
+
+
+def _quotes_params(codes):
+    """ulist 请求参数，返回 (params, {secid: 原代码})"""
+    secids = {resolve_secid(code): code for code in codes}
+    params = {"fltt": 2, "invt": 2, "secids": ",".join(secids), "fields": "f2,f12,f13,f18"}
+    return params, secids
+
+
+def _fetch_quotes(codes):
+    """一次 ulist 请求获取多个证券行情，codes 为证券代码或 secid"""
+    params, secids = _quotes_params(codes)
+    try:
+        response = http_client.get("push2", "/api/qt/ulist.np/get", params=params)
+        return _parse_quotes(response, secids)
     except Exception as e:
-        print(f"⚠️  天天基金网获取失败: {e}")
-        return {'success': False}
+        print(f"⚠️  批量获取行情失败: {e}")
+        return {}
+
+
+def _parse_quotes(response, secids):
+    """解析 ulist 响应，返回 {原代码: quote}"""
+    if response.status_code != 200:
+        return {}
+    diff = (response.json().get('data') or {}).get('diff') or []
+    if isinstance(diff, dict):
+        diff = list(diff.values())
+    
+    quotes = {}
+    for item in diff:
+        code = secids.get(f"{item.get('f13')}.{item.get('f12')}")
+        try:
+            current_price = float(item.get('f2'))      # 当前价
+            yesterday_close = float(item.get('f18'))   # 昨收
+        except (TypeError, ValueError):
+            continue  # 停牌等情况返回 "-"
+        if code and current_price and yesterday_close:
+            quotes[code] = {
+                'price': current_price,
+                'prev_close': yesterday_close,
+                'change_pct': (current_price - yesterday_close) / yesterday_close * 100,
+            }
+    return quotes
 
 
 def calculate_by_etf_price(fund, latest_nav):
@@ -209,64 +556,69 @@ def calculate_by_etf_price(fund, latest_nav):
     if not etf_code:
         return None
     
-    try:
-        # 尝试多个数据源
-        # 1. 东方财富
-        url = f"http://push2.eastmoney.com/api/qt/stock/get?secid=1.{etf_code}&fields=f43,f44,f45,f46,f60,f170"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('data'):
-                current_price = data['data'].get('f43')  # 当前价
-                yesterday_close = data['data'].get('f60')  # 昨收
-                
-                if current_price and yesterday_close:
-                    current_price = float(current_price) / 1000
-                    yesterday_close = float(yesterday_close) / 1000
-                    change_pct = (current_price - yesterday_close) / yesterday_close * 100
-                    
-                    estimated_nav = latest_nav * (1 + change_pct / 100)
-                    
-                    return {
-                        'estimate_nav': estimated_nav,
-                        'change_pct': change_pct,
-                        'change_amount': estimated_nav - latest_nav,
-                        'data_source': 'ETF价格计算',
-                        'note': f'基于{fund["etf_name"]}估算'
-                    }
-    except Exception as e:
-        pass
+    # 东方财富行情（按ETF代码缓存，多个联接基金共享同一行情）
+    quote = get_etf_quote(etf_code)
+    if not quote:
+        return None
     
-    return None
+    change_pct = quote['change_pct']
+    estimated_nav = latest_nav * (1 + change_pct / 100)
+    
+    return {
+        'estimate_nav': estimated_nav,
+        'change_pct': change_pct,
+        'change_amount': estimated_nav - latest_nav,
+        'data_source': EstimateSource.ETF,
+        'note': f'基于{fund.get("etf_name", etf_code)}估算'
+    }
 
 
-def get_fund_basic_info(fund_code):
+def calculate_by_components(fund, latest_nav, cached_only=False):
+    """
+    备用方案：按重仓股或基准指数组合计算估值
+    适用于主动型和债券型基金（见 fund_holdings）
+    cached_only=True 时只使用已缓存的行情（持仓每季度只抓取一次，仍按需抓取）
+    """
+    method, mix = fund_holdings.components(fund)
+    if not mix:
+        return None
+    quotes = get_quotes([secid for secid, _weight in mix], cached_only=cached_only)
+    weighted = fund_holdings.weighted_change(mix, quotes)
+    if weighted is None:
+        return None
+    
+    change_pct, coverage = weighted
+    estimated_nav = latest_nav * (1 + change_pct / 100)
+    if method == fund_holdings.METHOD_HOLDINGS:
+        note = f'基于前十大重仓股估算（覆盖{coverage:.0%}）'
+    else:
+        note = f'基于{fund.get("index_name") or "业绩基准"}估算'
+    return {
+        'estimate_nav': estimated_nav,
+        'change_pct': change_pct,
+        'change_amount': estimated_nav - latest_nav,
+        'data_source': EstimateSource(method),
+        'note': note
+    }
+
+
+def get_fund_basic_info(fund_code, fundgz=None):
     """
     获取基金基础信息（昨日净值）
-    用于完全的备用方案
+    用于完全的备用方案；fundgz 为已获取的 fetch_fundgz 结果
     """
-    try:
-        url = f"http://fundgz.1234567.com.cn/js/{fund_code}.js"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200 and response.text:
-            try:
-                json_str = response.text.split('(')[1].split(')')[0]
-                data = json.loads(json_str)
-                
-                return {
-                    'fund_name': data['name'],
-                    'latest_nav': float(data['dwjz']),
-                    'nav_date': data.get('jzrq', ''),
-                    'success': True
-                }
-            except (IndexError, json.JSONDecodeError, KeyError):
-                pass
-    except Exception:
-        pass
+    if fundgz is None:
+        fundgz = fetch_fundgz(fund_code)
+    if not fundgz['success']:
+        return {'success': False, 'reason': fundgz['reason']}
     
-    return {'success': False}
+    data = fundgz['payload']
+    return {
+        'fund_name': data['name'],
+        'latest_nav': float(data['dwjz']),
+        'nav_date': data.get('jzrq', ''),
+        'success': True
+    }
 
 
 # 风险评级标签映射
@@ -278,274 +630,435 @@ RISK_LEVEL_MAP = {
     'low5': 'R5 高风险',
 }
 
-def get_fund_risk_level(fund_code):
+def get_fund_risk_level(fund_code, use_cache=True):
     """
     从天天基金网获取基金风险评级 (R1-R5)
-    解析东方财富基金详情页 fivebar chooseLow 样式类
+    结果持久化到 fund_meta 缓存（长有效期；页面无评级时负缓存）
     """
     try:
-        url = f"https://fund.eastmoney.com/f10/tsdata_{fund_code}.html"
-        headers = {
-            'Referer': 'https://fund.eastmoney.com',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, timeout=8, headers=headers, verify=False)
-        if response.status_code == 200:
-            import re
-            # 匹配 <span class='lowX chooseLow'> 或 <span class="lowX chooseLow">
-            match = re.search(r"class=['\"]?(low[1-5])\s+chooseLow['\"]?", response.text)
-            if match:
-                level_key = match.group(1)
-                return RISK_LEVEL_MAP.get(level_key, level_key.upper())
+        if not use_cache:
+            return _fetch_fund_risk_level(fund_code)
+        return fund_meta.get_or_fetch(fund_code, 'risk_level', lambda: _fetch_fund_risk_level(fund_code))
     except Exception as e:
         print(f"   ⚠️  获取风险评级失败 ({fund_code}): {e}")
     return None
 
 
+def _fetch_fund_risk_level(fund_code):
+    """
+    解析东方财富基金详情页 fivebar chooseLow 样式类
+    请求失败抛出异常；页面没有评级返回 None
+    """
+    response = http_client.get("f10", f"/f10/tsdata_{fund_code}.html")
+    return _parse_risk_level(response)
+
+
+def _parse_risk_level(response):
+    """解析风险评级页面，HTTP 错误抛出异常，页面没有评级返回 None"""
+    response.raise_for_status()
+    # 匹配 <span class='lowX chooseLow'> 或 <span class="lowX chooseLow">
+    match = re.search(r"class=['\"]?(low[1-5])\s+chooseLow['\"]?", response.text)
+    if match:
+        level_key = match.group(1)
+        return RISK_LEVEL_MAP.get(level_key, level_key.upper())
+    return None
+
+
 def batch_update_risk_levels(data_file=None):
     """
     批量补全所有基金的风险评级。
     遍历 data_file 中的基金，对缺少 risk_level 的逐一从东方财富抓取并回写文件。
+    回写时只合并 risk_level 字段，不会覆盖抓取期间新增/删除的基金。
     """
-    import time
-    funds = load_funds(data_file)
-    updated = 0
-    for fund in funds:
+    if data_file is None:
+        data_file = DATA_FILE
+    store = fund_store.get_store(data_file)
+    levels = {}
+    for fund in store.list():
         if not fund.get('risk_level'):
             code = fund.get('code', '')
-            print(f"   🔍 抓取风险评级: {fund.get('name', code)} ({code})")
+            cached, _ = fund_meta.lookup(code, 'risk_level')
+            if not cached:
+                print(f"   🔍 抓取风险评级: {fund.get('name', code)} ({code})")
             level = get_fund_risk_level(code)
             if level:
-                fund['risk_level'] = level
-                updated += 1
+                levels[code] = {'risk_level': level}
                 print(f"      ✅ {level}")
-            time.sleep(0.5)  # 避免过快请求
+            if not cached:
+                time.sleep(0.5)  # 避免过快请求
+    updated = store.update_many(levels) if levels else 0
     if updated:
-        save_funds(funds, data_file)
         print(f"✅ 已更新 {updated} 个基金的风险评级")
     else:
         print("ℹ️  所有基金已有风险评级，无需更新")
     return updated
 
 
-def calculate_fund_estimate(fund):
+def _record_fundgz_history(fund_code, payload, estimate):
+    """记录 fundgz 返回的官方净值和盘中估值"""
+    if payload.get('jzrq'):
+        fund_history.record_nav(fund_code, payload['jzrq'], float(payload['dwjz']))
+    if estimate.estimate_time is not None:
+        fund_history.record_estimate(
+            fund_code, estimate.estimate_time.strftime("%Y-%m-%d %H:%M"), estimate.estimate_nav,
+            fund_history.SOURCE_FUNDGZ, estimate.latest_nav, estimate.change_pct,
+        )
+
+
+def _record_computed_history(estimate):
+    """记录按行情计算的估值（ETF价格 / 重仓股 / 基准指数）"""
+    fund_history.record_estimate(
+        estimate.code, estimate.estimate_time.strftime("%Y-%m-%d %H:%M"), estimate.estimate_nav,
+        estimate.data_source.value, estimate.latest_nav, estimate.change_pct,
+    )
+
+
+def _computed_estimate(fund, base, cached_only=False):
+    """
+    方案2：按行情计算估值（ETF联接基金用ETF价格，主动型/债券型用重仓股或基准指数）
+    base 为已有的估值结果（提供名称、昨日净值等）；无法计算时返回 None
+    昨日净值已经是最近交易日的净值（收盘后已公布）时，行情涨跌已计入净值，不再计算
     """
-    获取单个基金的估值信息
+    if base.nav_date and base.nav_date >= fund_cache.last_session_date():
+        return None
+    fund_type = fund.get('type')
+    if fund_type == 'etf_linked':
+        if cached_only and not estimate_cache.peek(f"etf:{fund.get('etf_code')}")[0]:
+            return None
+        backup_data = calculate_by_etf_price(fund, base.latest_nav)
+    elif fund_type in ('active', 'bond'):
+        backup_data = calculate_by_components(fund, base.latest_nav, cached_only)
+    else:
+        return None
+    if not backup_data:
+        return None
+    return replace(
+        base,
+        estimate_nav=backup_data['estimate_nav'],
+        change_pct=backup_data['change_pct'],
+        data_source=backup_data['data_source'],
+        estimate_time=datetime.now(MARKET_TZ).replace(tzinfo=None, second=0, microsecond=0),
+        note=backup_data['note'],
+    )
+
+
+def _shadow_estimate(fund, estimate):
+    """
+    天天基金网有估值时，也记录一份按行情计算的估值作为准确度对照
+    只使用已缓存（批量预取）的行情，不额外请求行情
+    """
+    shadow = _computed_estimate(fund, estimate, cached_only=True)
+    if shadow:
+        _record_computed_history(shadow)
+    return shadow
+
+
+def _history_estimate(fund, risk_level):
+    """天天基金网不可用时，用本地记录的最近净值作为估算基础"""
+    row = fund_history.latest_nav(fund['code'])
+    if row is None:
+        return None
+    nav_date, nav = row
+    return FundEstimate(
+        code=fund['code'],
+        name=fund.get('name') or fund_meta.get_meta(fund['code']).get('name') or fund['code'],
+        source=fund.get('source', '未知'),
+        risk_level=risk_level,
+        fund_type=fund.get('type', ''),
+        latest_nav=nav,
+        estimate_nav=nav,
+        change_pct=0.0,
+        data_source=EstimateSource.NAV,
+        nav_date=parse_date(nav_date),
+        type_label=type_label(fund),
+    )
+
+
+def _upstream_healthy(upstream, cache_key=None):
+    """按熔断器健康分决定是否请求该上游；cache_key 已缓存时不需要请求，视为可用"""
+    if cache_key and estimate_cache.peek(cache_key)[0]:
+        return True
+    return http_client.is_available(upstream, UPSTREAM_MIN_HEALTH)
+
+
+def calculate_fund_estimate(fund, fundgz=None):
+    """
+    获取单个基金的估值信息，返回 FundEstimate（数值字段），无法获取时返回 None
     策略：
     1. 优先尝试天天基金网（如果还能用）
-    2. 如果失败，ETF联接基金用ETF价格计算
+    2. 如果失败，按行情计算：ETF联接基金用ETF价格，主动型用前十大重仓股，
+       无持仓数据的主动型和债券型用基准指数（昨日净值取自天天基金网或本地历史净值）
     3. 最终兜底：只显示昨日净值
+    历史统计（fund_accuracy）显示方案2更准的基金，优先使用方案2
+    上游健康分过低（http_client 熔断器统计）时不再请求它，直接进入下一个方案
+    接口/维格表所需的中文字段行由 fund_models.to_row 生成
+    耗时按最终使用的方案记入 metrics，期间的上游请求带上 fund / tier 标签
+    fundgz: 已获取的 fetch_fundgz 结果（异步流水线预取），传入时不再请求
     """
+    started = time.monotonic()
+    result = None
+    with metrics.tagged(fund=fund.get('code'), tier='meta'):
+        try:
+            result = _calculate_fund_estimate(fund, fundgz)
+            return result
+        finally:
+            tier = result.data_source.value if result else 'failed'
+            elapsed = time.monotonic() - started
+            metrics.ESTIMATE_LATENCY.observe(elapsed, tier=tier)
+            metrics.log_event('estimate', result=tier, elapsed=round(elapsed, 4))
+
+
+def _calculate_fund_estimate(fund, fundgz=None):
     fund_code = fund['code']
-    fund_name = fund['name']
-    fund_type = fund['type']
+    fund_type = fund.get('type', '')
     fund_source = fund.get('source', '未知')  # 获取来源
 
-    # 风险评级：先用配置里手动设置的，再尝试从网页抓取
+    # 风险评级：先用配置里手动设置的，再读元数据缓存（未命中才抓取网页）
     risk_level = fund.get('risk_level')
     if not risk_level:
         risk_level = get_fund_risk_level(fund_code) or '未知'
     
-    print(f"\n📊 处理基金: {fund_name} ({fund_code}) - 来源: {fund_source} - 风险: {risk_level}")
+    print(f"\n📊 处理基金: {fund.get('name', fund_code)} ({fund_code}) - 来源: {fund_source} - 风险: {risk_level}")
     
     # 方案1：天天基金网（可能随时失效）
-    data = get_fund_realtime_data(fund_code)
-    
-    if data['success']:
-        # 成功获取数据
-        result = {
-            "基金名称": data['fund_name'],
-            "基金代码": fund_code,
-            "来源": fund_source,
-            "风险评级": risk_level,
-            "昨日净值": f"{data['latest_nav']:.4f}",
-            "当前估值": f"{data['estimate_nav']:.4f}",
-            "涨跌幅": f"{data['change_pct']/100:.4f}",
-            "涨跌额": f"{data['change_amount']:+.4f}",
-            "更新时间": data['estimate_time'],
-            "数据来源": data.get('data_source', '天天基金网')
-        }
-        
-        # 添加类型信息
-        if fund_type == "etf_linked":
-            result["类型"] = f"ETF联接-{fund.get('etf_name', '')}"
-        elif fund_type == "active":
-            result["类型"] = "主动型"
-        elif fund_type == "bond":
-            result["类型"] = "债券型"
-        
-        if 'note' in data:
-            result["备注"] = data['note']
-        
-        print(f"   ✅ 昨日净值: {data['latest_nav']:.4f}")
-        print(f"   ✅ 当前估值: {data['estimate_nav']:.4f}")
-        print(f"   ✅ 涨跌: {data['change_pct']:+.2f}%")
-        
-        return result
-    
-    # 方案2：备用计算（仅ETF联接基金）
-    print(f"   ⚠️  天天基金网失效，尝试备用方案...")
-    
-    basic_info = get_fund_basic_info(fund_code)
-    if not basic_info['success']:
-        print(f"   ❌ 无法获取基金信息")
-        return None
-    
-    latest_nav = basic_info['latest_nav']
+    # 同一份 jsonpgz 结果（或失败原因）供后续方案复用，每只基金只请求一次
+    metrics.set_tags(tier='fundgz')
+    if fundgz is None:
+        # 天天基金网不健康且有本地历史净值可作估算基础时才跳过
+        if _upstream_healthy('fundgz', f"fundgz:{fund_code}") or fund_history.latest_nav(fund_code) is None:
+            fundgz = fetch_fundgz(fund_code)
+        else:
+            fundgz = {'success': False, 'reason': FUNDGZ_ERROR_NETWORK, 'error': '天天基金网健康分过低，跳过'}
+    data = get_fund_realtime_data(fund_code, fundgz=fundgz)
+    if fundgz['success']:
+        payload = fundgz['payload']
+        fund_meta.remember_fund(fund, name=payload['name'])
+        no_estimate = data.get('reason') == FUNDGZ_ERROR_NO_ESTIMATE
+        estimate = FundEstimate(
+            code=fund_code,
+            name=data['fund_name'],
+            source=fund_source,
+            risk_level=risk_level,
+            fund_type=fund_type,
+            latest_nav=data['latest_nav'],
+            estimate_nav=data['estimate_nav'],
+            change_pct=data['change_pct'],
+            data_source=EstimateSource.FUNDGZ,
+            estimate_time=None if no_estimate else parse_time(data['estimate_time']),
+            nav_date=parse_date(payload.get('jzrq')),
+            type_label=type_label(fund),
+            note=data.get('note'),
+        )
+        _record_fundgz_history(fund_code, payload, estimate)
+
+        if not no_estimate:
+            # 历史上按行情计算更准时，优先使用方案2
+            metrics.set_tags(tier='shadow')
+            shadow = _shadow_estimate(fund, estimate)
+            if shadow is not None and fund_accuracy.preferred_source(fund_code) == shadow.data_source.value:
+                print(f"   📐 历史统计显示{shadow.data_source.label}更准，使用备用方案")
+                return shadow
+
+            # 成功获取数据
+            print(f"   ✅ 昨日净值: {estimate.latest_nav:.4f}")
+            print(f"   ✅ 当前估值: {estimate.estimate_nav:.4f}")
+            print(f"   ✅ 涨跌: {estimate.change_pct:+.2f}%")
+            return estimate
+    else:
+        estimate = _history_estimate(fund, risk_level)
+        if estimate is None:
+            print(f"   ❌ 无法获取基金信息 ({fundgz['reason']})")
+            return None
     
-    # 如果是ETF联接基金，尝试用ETF价格计算
-    if fund_type == "etf_linked":
-        backup_data = calculate_by_etf_price(fund, latest_nav)
-        if backup_data:
-            print(f"   ✅ 使用备用方案计算成功")
-            return {
-                "基金名称": basic_info['fund_name'],
-                "基金代码": fund_code,
-                "来源": fund_source,
-                "风险评级": risk_level,
-                "类型": f"ETF联接-{fund.get('etf_name', '')}",
-                "昨日净值": f"{latest_nav:.4f}",
-                "当前估值": f"{backup_data['estimate_nav']:.4f}",
-                "涨跌幅": f"{backup_data['change_pct']/100:.4f}",
-                "涨跌额": f"{backup_data['change_amount']:+.4f}",
-                "更新时间": datetime.now().strftime("%H:%M"),
-                "数据来源": backup_data['data_source'],
-                "备注": backup_data['note']
-            }
+    # 方案2：按行情计算
+    metrics.set_tags(tier='computed')
+    print(f"   ⚠️  天天基金网无可用估值 ({data['reason']})，尝试备用方案...")
+    # 行情上游不健康时只用已缓存（批量预取）的行情
+    backup = _computed_estimate(fund, estimate, cached_only=not _upstream_healthy('push2'))
+    if backup:
+        print(f"   ✅ 使用备用方案计算成功 ({backup.data_source.label})")
+        _record_computed_history(backup)
+        return backup
     
     # 方案3：最终兜底 - 只显示昨日净值
     print(f"   ℹ️  仅显示昨日净值")
-    return {
-        "基金名称": basic_info['fund_name'],
-        "基金代码": fund_code,
-        "来源": fund_source,
-        "风险评级": risk_level,
-        "类型": fund_type,
-        "昨日净值": f"{latest_nav:.4f}",
-        "当前估值": f"{latest_nav:.4f}",
-        "涨跌幅": "0.0000",
-        "涨跌额": "0.0000",
-        "更新时间": basic_info['nav_date'],
-        "数据来源": "昨日净值",
-        "备注": "暂无实时数据"
-    }
+    return replace(estimate, estimate_nav=estimate.latest_nav, change_pct=0.0,
+                   data_source=EstimateSource.NAV, estimate_time=None, note="暂无实时数据")
+
+
+def iter_fund_estimates(funds, max_workers=None, timeout=None):
+    """
+    并发获取基金估值，按完成顺序逐个产出 (index, fund, result)
+    - result 为 FundEstimate、None（获取失败）或异常（含超时 TimeoutError）
+    - timeout 为整批的总截止时间（秒），到期后未完成的基金以 TimeoutError 产出
+    - 默认在独立的事件循环中逐个取出 fund_async.iter_fund_estimates 的结果（异步流水线）；
+      ESTIMATE_PIPELINE=threads 或当前线程已有运行中的事件循环时，使用有界线程池逐只估值
+    """
+    funds = list(funds)
+    if not funds:
+        return
+    if ESTIMATE_PIPELINE == 'async' and not _loop_running():
+        yield from _iter_async_estimates(funds, max_workers, timeout)
+        return
+    if max_workers is None:
+        max_workers = ESTIMATE_MAX_WORKERS
+    if timeout is None:
+        timeout = ESTIMATE_BATCH_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    # 估值（多基金接口）、ETF联接基金的行情、主动型/债券型基金（已缓存持仓）的成分行情各自批量预取，
+    # 逐只估值时直接命中缓存
+    with metrics.tagged(tier='prefetch'):
+        if FUNDGZ_BATCH:
+            prefetch_fundgz([f['code'] for f in funds])
+        etf_codes = [f.get('etf_code') for f in funds if f.get('type') == 'etf_linked']
+        if etf_codes:
+            get_etf_quotes(etf_codes)
+        secids = [secid for f in funds if f.get('type') in ('active', 'bond')
+                  for secid, _weight in fund_holdings.components(f, fetch=False)[1]]
+        if secids:
+            get_quotes(secids)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(funds))),
+                                  thread_name_prefix="fund-estimate")
+    try:
+        futures = {executor.submit(calculate_fund_estimate, fund): i for i, fund in enumerate(funds)}
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+                pending.discard(future)
+                i = futures[future]
+                error = future.exception()
+                if error is not None:
+                    print(f"   ❌ 基金 {funds[i].get('code')} 估值出错: {error}")
+                    yield i, funds[i], error
+                else:
+                    yield i, funds[i], future.result()
+        except FuturesTimeoutError:
+            print(f"⏱️  批量估值超时 ({timeout}s)，{len(pending)} 个基金未完成")
+            for future in sorted(pending, key=futures.get):
+                i = futures[future]
+                yield i, funds[i], TimeoutError(f"估值超时 ({timeout}s)")
+    finally:
+        # 不等待超时的任务，直接返回已完成部分
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_async_estimates(funds, max_workers=None, timeout=None):
+    """以同步生成器的形式驱动 fund_async.iter_fund_estimates（独立事件循环，用完关闭）"""
+    import asyncio
+    import fund_async
+
+    loop = asyncio.new_event_loop()
+    estimates = fund_async.iter_fund_estimates(funds, max_workers, timeout)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(estimates.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(estimates.aclose())
+        loop.run_until_complete(fund_async.client.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
 
 
-def update_vika_table(records):
-    """使用 REST API 智能更新维格表 (Upsert: 有则更新，无则新增，多则删除)"""
-    if not VIKA_API_TOKEN or not VIKA_DATASHEET_ID:
+def calculate_fund_estimates(funds, max_workers=None, timeout=None, return_exceptions=False):
+    """
+    批量并发获取基金估值
+    - 同步接口：默认通过 asyncio.run 执行 fund_async.calculate_fund_estimates（异步流水线）；
+      ESTIMATE_PIPELINE=threads 或当前线程已有运行中的事件循环时，使用有界线程池逐只估值
+    - 返回 FundEstimate 列表，与 funds 顺序一一对应，失败项为 None
+    - timeout 为整批的总截止时间（秒），超时未完成的基金不再等待
+    - return_exceptions=True 时，异常（含超时 TimeoutError）按位置放入结果列表
+    """
+    funds = list(funds)
+    if ESTIMATE_PIPELINE == 'async' and not _loop_running():
+        import fund_async
+        return fund_async.run(fund_async.calculate_fund_estimates(funds, max_workers, timeout, return_exceptions))
+
+    results = [None] * len(funds)
+    for i, _fund, result in iter_fund_estimates(funds, max_workers, timeout):
+        if isinstance(result, Exception) and not return_exceptions:
+            continue
+        results[i] = result
+    return results
+
+
+def _loop_running():
+    """当前线程是否已在事件循环中（此时不能再 asyncio.run）"""
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+# 各用户单独设置、不影响估值计算的字段
+USER_OVERRIDE_FIELDS = ('source', 'risk_level')
+
+
+def calculate_user_estimates(user_funds, max_workers=None, timeout=None, return_exceptions=False):
+    """
+    多用户批量估值：跨用户去重，每个基金代码只估值一次
+    user_funds: {user: [fund, ...]}
+    返回: {user: [result, ...]}，各列表与输入顺序一致；
+    结果按用户复制一份，并套用该用户自己的来源 (source) 和风险评级 (risk_level)
+    """
+    # 同一代码的配置合并（先出现的优先），供估值使用
+    unique = {}
+    for funds in user_funds.values():
+        for fund in funds:
+            merged = unique.setdefault(fund['code'], {})
+            for key, value in fund.items():
+                if value not in (None, '') and key not in merged:
+                    merged[key] = value
+
+    codes = list(unique)
+    print(f"🔗 {len(user_funds)} 个用户共 {sum(len(f) for f in user_funds.values())} 个基金，去重后 {len(codes)} 个")
+    estimates = dict(zip(codes, calculate_fund_estimates(
+        [unique[code] for code in codes], max_workers, timeout, return_exceptions
+    )))
+
+    results = {}
+    for user, funds in user_funds.items():
+        rows = []
+        for fund in funds:
+            res = estimates[fund['code']]
+            if isinstance(res, FundEstimate):
+                res = replace(res, source=fund.get('source', '未知'),
+                              risk_level=fund.get('risk_level') or res.risk_level)
+            rows.append(res)
+        results[user] = rows
+    return results
+
+
+def update_vika_table(records, raise_errors=False):
+    """
+    增量同步到维格表 (Upsert: 有则更新变化字段，无则新增，多则删除)
+    records 为 FundEstimate 或已序列化的中文字段行
+    raise_errors=True 时失败抛出异常（供后台同步线程记录错误）
+    """
+    context = get_context()
+    if not context.vika_api_token or not context.vika_datasheet_id:
         print("❌ 缺少维格表配置信息")
+        if raise_errors:
+            raise RuntimeError("缺少维格表配置信息")
         return False
     
+    records = [to_row(r) if isinstance(r, FundEstimate) else r for r in records]
     try:
-        headers = {
-            "Authorization": f"Bearer {VIKA_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        # 1. 获取现有所有数据（建立索引）
-        print("\n🔍 检查现有记录...")
-        list_url = f"{VIKA_API_BASE}/datasheets/{VIKA_DATASHEET_ID}/records"
-        params = {"pageSize": 1000} 
-        response = requests.get(list_url, headers=headers, params=params, timeout=10, verify=False)
-        
-        # 避免QPS限制
-        import time
-        time.sleep(0.5)
-
-        existing_map = {} # 格式: { "002963": ["rec1", "rec2"], ... }
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('data') and data['data'].get('records'):
-                for rec in data['data']['records']:
-                    rid = rec['recordId']
-                    # 获取基金代码，注意这里如果列名没对上，code会是None
-                    f_code = rec['fields'].get('基金代码')
-                    
-                    if f_code:
-                        if f_code not in existing_map:
-                            existing_map[f_code] = []
-                        existing_map[f_code].append(rid)
-                    else:
-                        # 可能是脏数据（比如之前没填进去的空行）
-                        if "unknown" not in existing_map:
-                            existing_map["unknown"] = []
-                        existing_map["unknown"].append(rid)
-
-        # 2. 分类操作：需要更新的、需要新增的、需要删除的
-        to_create = []
-        to_update = []
-        to_delete = []
-        
-        # 记录本次涉及到的 有效 recordIds
-        processed_fund_codes = set()
-        
-        # 先把所有未知的（脏数据）加入删除列表
-        if "unknown" in existing_map:
-            to_delete.extend(existing_map["unknown"])
-
-        for record in records:
-            code = record['基金代码']
-            processed_fund_codes.add(code)
-            
-            if code in existing_map and existing_map[code]:
-                # 存在：更新第一条
-                target_id = existing_map[code][0]
-                to_update.append({
-                    "recordId": target_id,
-                    "fields": record
-                })
-                # 如果有重复的（同一个代码多条记录），把剩下的加入删除列表
-                if len(existing_map[code]) > 1:
-                    to_delete.extend(existing_map[code][1:])
-            else:
-                # 不存在：新增
-                to_create.append({
-                    "fields": record
-                })
-
-        # 3. 删除不在本次列表里的其他过时数据
-        for code, rids in existing_map.items():
-            if code != "unknown" and code not in processed_fund_codes:
-                to_delete.extend(rids)
-        
-        # 4. 执行操作
-        # 4.1 批量删除
-        if to_delete:
-            print(f"🗑️  清理 {len(to_delete)} 条重复或脏数据...")
-            for i in range(0, len(to_delete), 10):
-                batch = to_delete[i:i+10]
-                ids_str = ",".join(batch)
-                del_url = f"{VIKA_API_BASE}/datasheets/{VIKA_DATASHEET_ID}/records?recordIds={ids_str}"
-                requests.delete(del_url, headers=headers, verify=False)
-                time.sleep(0.5)
-
-        # 4.2 批量更新
-        if to_update:
-            print(f"🔄 更新 {len(to_update)} 条现有数据...")
-            patch_url = f"{VIKA_API_BASE}/datasheets/{VIKA_DATASHEET_ID}/records"
-            for i in range(0, len(to_update), 10):
-                batch = to_update[i:i+10]
-                payload = {"records": batch}
-                requests.patch(patch_url, json=payload, headers=headers, verify=False)
-                time.sleep(0.5)
-
-        # 4.3 批量新增
-        if to_create:
-            print(f"📝 新增 {len(to_create)} 条新数据...")
-            create_url = f"{VIKA_API_BASE}/datasheets/{VIKA_DATASHEET_ID}/records"
-            for i in range(0, len(to_create), 10):
-                batch = to_create[i:i+10]
-                payload = {"records": batch}
-                requests.post(create_url, json=payload, headers=headers, verify=False)
-                time.sleep(0.5)
-
-        print(f"✅ 同步完成：更新{len(to_update)} / 新增{len(to_create)} / 清理{len(to_delete)}")
+        stats = vika_sync.sync_records(records, context.vika_api_token, context.vika_datasheet_id)
+        print(f"✅ 同步完成：更新{stats['updated']} / 新增{stats['created']} / 清理{stats['deleted']}"
+              f"（写请求 {stats['writes']} 次）")
         return True
         
     except Exception as e:
         print(f"❌ 更新维格表失败: {e}")
+        if raise_errors:
+            raise
         return False
 
 
@@ -556,13 +1069,11 @@ def main():
     print("=" * 60)
     print(f"⏰ 运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    results = []
-    
-    # 遍历所有基金
-    for fund in FUNDS:
-        result = calculate_fund_estimate(fund)
-        if result:
-            results.append(result)
+    import fund_async
+
+    # 异步流水线并发获取所有基金估值（fund_async.run 即 asyncio.run，结束时关闭连接）
+    context = get_context()
+    results = [r for r in fund_async.run(fund_async.calculate_fund_estimates(context.funds)) if r]
     
     # 输出汇总
     print("\n" + "=" * 60)
@@ -570,10 +1081,10 @@ def main():
     print("=" * 60)
     
     for i, result in enumerate(results, 1):
-        print(f"\n{i}. {result['基金名称']}")
-        print(f"   昨日净值: {result['昨日净值']}")
-        print(f"   涨跌幅: {result['涨跌幅']}")
-        print(f"   当前估值: {result['当前估值']}")
+        print(f"\n{i}. {result.name}")
+        print(f"   昨日净值: {result.latest_nav:.4f}")
+        print(f"   涨跌幅: {result.change_pct:+.2f}%")
+        print(f"   当前估值: {result.estimate_nav:.4f}")
     
     # 更新到维格表
     if results:
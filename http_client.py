@@ -0,0 +1,430 @@
+"""
+上游 HTTP 会话层
+- 每个上游共享一个 requests.Session（连接池 + HTTP keep-alive）
+- 每个上游独立配置超时、重试/退避、并发上限
+- 可替换 base_url 或 Session，便于测试时接入本地桩服务器
+- 每个上游一个熔断器：滚动窗口内失败/慢调用比例过高时熔断，请求立即失败，
+  冷却后放行单个探测请求，成功即恢复
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+
+# 上游配置
+# base_url 可通过环境变量 UPSTREAM_<NAME>_BASE_URL 覆盖（如 UPSTREAM_FUNDGZ_BASE_URL）
+# read_retries: 读超时（请求已发出）的重试次数，None 与 retries 相同；
+#   估值路径上的上游设为 0，挂起的请求只等一次 timeout，不会耗尽批量估值的总截止时间
+UPSTREAMS = {
+    # 天天基金实时估值 jsonpgz
+    "fundgz": {
+        "base_url": "http://fundgz.1234567.com.cn",
+        "timeout": 10,
+        "retries": 1,
+        "read_retries": 0,
+        "backoff": 0.3,
+        "concurrency": 8,
+        "verify": True,
+        "headers": {},
+        "breaker": {},
+    },
+    # 天天基金移动端多基金估值接口（Fcodes 逗号分隔，一次返回多只基金的估值和最新净值）
+    "fundmob": {
+        "base_url": "https://fundmobapi.eastmoney.com",
+        "timeout": 8,
+        "retries": 1,
+        "read_retries": 0,
+        "backoff": 0.3,
+        "concurrency": 2,
+        "verify": False,
+        "headers": {},
+        "breaker": {},
+    },
+    # 东方财富行情
+    "push2": {
+        "base_url": "http://push2.eastmoney.com",
+        "timeout": 5,
+        "retries": 1,
+        "read_retries": 0,
+        "backoff": 0.3,
+        "concurrency": 4,
+        "verify": True,
+        "headers": {},
+        "breaker": {},
+    },
+    # 东方财富基金 F10 页面（风险评级）
+    "f10": {
+        "base_url": "https://fund.eastmoney.com",
+        "timeout": 8,
+        "retries": 2,
+        "read_retries": 0,
+        "backoff": 0.5,
+        "concurrency": 4,
+        "verify": False,
+        "headers": {
+            "Referer": "https://fund.eastmoney.com",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        },
+        "breaker": {},
+    },
+    # 维格表 REST API（429 限流时按 Retry-After 退避）
+    "vika": {
+        "base_url": "https://vika.cn/fusion/v1",
+        "timeout": 10,
+        "retries": 3,
+        "read_retries": None,
+        "backoff": 1.0,
+        "concurrency": 2,
+        "verify": False,
+        "headers": {},
+        "breaker": {},
+    },
+}
+
+# 重试的状态码（连接错误总会重试）
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 熔断默认配置（可通过环境变量调整，或在 UPSTREAMS[name]["breaker"] 中按上游覆盖）
+BREAKER_DEFAULTS = {
+    "window": float(os.environ.get("BREAKER_WINDOW", "60")),               # 滚动窗口（秒）
+    "min_requests": int(os.environ.get("BREAKER_MIN_REQUESTS", "5")),      # 窗口内少于该请求数不判断
+    "error_rate": float(os.environ.get("BREAKER_ERROR_RATE", "0.5")),      # 失败（含慢调用）比例阈值
+    "slow_ratio": float(os.environ.get("BREAKER_SLOW_RATIO", "0.8")),      # 耗时超过 timeout 的该比例视为慢调用
+    "open_seconds": float(os.environ.get("BREAKER_OPEN_SECONDS", "30")),   # 熔断后多久放行探测请求
+}
+
+for _name, _cfg in UPSTREAMS.items():
+    _env_url = os.environ.get(f"UPSTREAM_{_name.upper()}_BASE_URL", "").strip()
+    if _env_url:
+        _cfg["base_url"] = _env_url
+
+_sessions = {}
+_semaphores = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """上游处于熔断状态，请求未发出"""
+
+
+class CircuitBreaker:
+    """
+    单个上游的熔断器
+    closed: 正常放行，记录滚动窗口内的结果
+    open: 直接拒绝，open_seconds 后转为 half_open
+    half_open: 只放行一个探测请求，成功则 closed，失败（或慢）则重新 open
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window, min_requests, error_rate, slow_call, open_seconds):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._calls = deque()   # (时间, 是否失败, 耗时)
+        self._opened_at = None
+        self._opened_wall = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.trips = 0
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._opened_wall = datetime.now().isoformat(timespec='seconds')
+        self._probing = False
+        self.trips += 1
+        print(f"🔌 上游 {self.name} 熔断 {self.open_seconds:g}s")
+
+    def allow(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, failed, latency):
+        """记录一次请求结果（耗时秒数）"""
+        now = time.monotonic()
+        failed = failed or (self.slow_call is not None and latency > self.slow_call)
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probing:
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = self.CLOSED
+                    self._probing = False
+                    self._calls.clear()
+                    print(f"🔌 上游 {self.name} 已恢复")
+                return
+            self._calls.append((now, failed, latency))
+            self._trim(now)
+            if self.state == self.CLOSED and len(self._calls) >= self.min_requests:
+                failures = sum(1 for _t, f, _l in self._calls if f)
+                if failures / len(self._calls) >= self.error_rate:
+                    self._open(now)
+
+    def snapshot(self):
+        """当前状态与窗口统计"""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            total = len(self._calls)
+            failures = sum(1 for _t, f, _l in self._calls if f)
+            latencies = sorted(l for _t, _f, l in self._calls)
+            error_rate = failures / total if total else 0.0
+            if self.state == self.OPEN:
+                health = 0.0
+            elif self.state == self.HALF_OPEN:
+                health = 0.5
+            else:
+                health = 1.0 - error_rate
+            return {
+                "state": self.state,
+                "health": round(health, 3),
+                "requests": total,
+                "failures": failures,
+                "error_rate": round(error_rate, 3),
+                "p50_latency": round(latencies[total // 2], 3) if total else None,
+                "max_latency": round(latencies[-1], 3) if total else None,
+                "opened_at": self._opened_wall if self.state != self.CLOSED else None,
+                "retry_in": round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+                            if self.state == self.OPEN else None,
+                "rejected": self.rejected,
+                "trips": self.trips,
+            }
+
+
+def _build_breaker(name, cfg):
+    options = {**BREAKER_DEFAULTS, **(cfg.get("breaker") or {})}
+    slow_call = options.get("slow_call")
+    if slow_call is None and options["slow_ratio"]:
+        slow_call = cfg["timeout"] * options["slow_ratio"]
+    return CircuitBreaker(name, options["window"], options["min_requests"], options["error_rate"],
+                          slow_call, options["open_seconds"])
+
+
+def get_breaker(upstream):
+    """获取（必要时创建）指定上游的熔断器"""
+    with _lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _build_breaker(upstream, UPSTREAMS[upstream])
+            _breakers[upstream] = breaker
+        return breaker
+
+
+def is_available(upstream, min_health=0.0):
+    """
+    上游当前是否值得请求（估值按此选择方案）
+    - 熔断中：冷却已过、可以发探测请求时才算可用
+    - 其余状态：健康分不低于 min_health（半开探测为 0.5；窗口内请求数不足 min_requests 时不判断）
+    """
+    breaker = get_breaker(upstream)
+    snapshot = breaker.snapshot()
+    if snapshot["state"] == CircuitBreaker.OPEN:
+        return snapshot["retry_in"] == 0
+    if snapshot["state"] == CircuitBreaker.CLOSED and snapshot["requests"] < breaker.min_requests:
+        return True
+    return snapshot["health"] >= min_health
+
+
+def breaker_states():
+    """所有上游的熔断状态 {upstream: snapshot}"""
+    return {name: get_breaker(name).snapshot() for name in UPSTREAMS}
+
+
+def _breaker_samples():
+    states = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+    return [({"upstream": name}, states.index(snapshot["state"]))
+            for name, snapshot in breaker_states().items()]
+
+
+metrics.Collector("fund_upstream_circuit_state", "熔断状态（0 正常，1 半开探测，2 熔断）", "gauge",
+                  _breaker_samples)
+
+
+def reset_breakers():
+    """清除所有熔断状态"""
+    with _lock:
+        _breakers.clear()
+
+
+def _build_session(cfg):
+    """按上游配置创建带连接池和重试策略的 Session"""
+    retry = Retry(
+        total=cfg["retries"],
+        read=cfg["read_retries"],
+        backoff_factor=cfg["backoff"],
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(["GET", "HEAD", "PATCH", "DELETE"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=cfg["concurrency"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(cfg.get("headers") or {})
+    if not cfg["verify"]:
+        # 关闭证书校验的上游（仅用于解决某些网络环境的证书问题）不输出 SSL 警告
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return session
+
+
+def get_session(upstream):
+    """获取（必要时创建）指定上游的共享 Session"""
+    with _lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = _build_session(UPSTREAMS[upstream])
+            _sessions[upstream] = session
+        return session
+
+
+def set_session(upstream, session):
+    """注入自定义 Session（例如测试桩），传 None 恢复默认"""
+    with _lock:
+        old = _sessions.pop(upstream, None)
+        if session is not None:
+            _sessions[upstream] = session
+    if old is not None and old is not session:
+        old.close()
+
+
+def configure_upstream(upstream, **overrides):
+    """
+    修改上游配置（base_url / timeout / retries / read_retries / backoff / concurrency / verify / headers / breaker）
+    已创建的 Session 和熔断器会被重建以应用新配置
+    """
+    cfg = UPSTREAMS[upstream]
+    unknown = set(overrides) - set(cfg)
+    if unknown:
+        raise KeyError(f"未知的上游配置项: {', '.join(sorted(unknown))}")
+    with _lock:
+        cfg.update(overrides)
+        old = _sessions.pop(upstream, None)
+        _semaphores.pop(upstream, None)
+        _breakers.pop(upstream, None)
+    if old is not None:
+        old.close()
+
+
+def reset_sessions():
+    """关闭并丢弃所有 Session（下次请求时重建）"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _semaphores.clear()
+    for session in sessions:
+        session.close()
+
+
+@contextmanager
+def upstream_slot(upstream):
+    """限制单个上游同时在途的请求数"""
+    with _lock:
+        sem = _semaphores.get(upstream)
+        if sem is None:
+            sem = threading.BoundedSemaphore(UPSTREAMS[upstream]["concurrency"])
+            _semaphores[upstream] = sem
+    with sem:
+        yield
+
+
+def build_url(upstream, path):
+    """拼接上游 base_url 与路径；传入完整 URL 时原样返回"""
+    if path.startswith(("http://", "https://")):
+        return path
+    return UPSTREAMS[upstream]["base_url"].rstrip("/") + "/" + path.lstrip("/")
+
+
+def request(upstream, method, path, **kwargs):
+    """
+    通过上游共享 Session 发起请求，未指定时使用上游默认超时和证书校验
+    上游熔断中时立即抛出 CircuitOpenError；异常、5xx 和 429 计为失败
+    耗时与结果记入 metrics（标签取自 metrics.tagged 设置的 tier / fund）
+    """
+    cfg = UPSTREAMS[upstream]
+    kwargs.setdefault("timeout", cfg["timeout"])
+    kwargs.setdefault("verify", cfg["verify"])
+    url = build_url(upstream, path)
+    tier = metrics.current_tags().get("tier", "")
+    breaker = get_breaker(upstream)
+    if not breaker.allow():
+        metrics.UPSTREAM_ERRORS.inc(upstream=upstream, reason="circuit_open", tier=tier)
+        metrics.log_event("upstream", upstream=upstream, method=method, status="circuit_open", elapsed=0)
+        raise CircuitOpenError(f"上游 {upstream} 熔断中，跳过请求")
+    with upstream_slot(upstream):
+        started = time.monotonic()
+        try:
+            response = get_session(upstream).request(method, url, **kwargs)
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            breaker.record(True, elapsed)
+            _observe(upstream, method, "error", tier, elapsed, type(e).__name__)
+            raise
+    elapsed = time.monotonic() - started
+    failed = response.status_code >= 500 or response.status_code == 429
+    breaker.record(failed, elapsed)
+    _observe(upstream, method, response.status_code, tier, elapsed, f"http_{response.status_code}" if failed else None)
+    return response
+
+
+def _observe(upstream, method, status, tier, elapsed, error=None):
+    metrics.UPSTREAM_LATENCY.observe(elapsed, upstream=upstream, method=method, status=status, tier=tier)
+    if error:
+        metrics.UPSTREAM_ERRORS.inc(upstream=upstream, reason=error, tier=tier)
+    metrics.log_event("upstream", upstream=upstream, method=method, status=status,
+                      elapsed=round(elapsed, 4), error=error)
+
+
+def get(upstream, path, **kwargs):
+    return request(upstream, "GET", path, **kwargs)
+
+
+def post(upstream, path, **kwargs):
+    return request(upstream, "POST", path, **kwargs)
+
+
+def patch(upstream, path, **kwargs):
+    return request(upstream, "PATCH", path, **kwargs)
+
+
+def delete(upstream, path, **kwargs):
+    return request(upstream, "DELETE", path, **kwargs)
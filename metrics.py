@@ -0,0 +1,177 @@
+"""
+运行指标
+- 直方图 / 计数器按标签聚合，/metrics 以 Prometheus 文本格式输出
+- 上游请求耗时按 upstream / method / status / tier 聚合；
+  基金代码不作为标签（基数太大），只写入结构化日志（METRICS_LOG=1 开启，每次请求一行 JSON）
+- tagged() 为当前线程（contextvars）设置 fund / tier 标签，期间的上游请求自动带上
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_LOG = os.environ.get("METRICS_LOG", "0") == "1"
+
+# 默认分桶（秒），覆盖缓存命中到上游超时
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("fund_tracker.metrics")
+if METRICS_LOG and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_tags = ContextVar("metrics_tags", default={})
+
+
+@contextmanager
+def tagged(**tags):
+    """在 with 块内为上游请求附加标签（如 fund=代码、tier=方案）"""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def set_tags(**tags):
+    """修改当前标签（在 tagged() 块内使用，块结束时一并恢复）"""
+    _tags.set({**_tags.get(), **tags})
+
+
+def current_tags():
+    return _tags.get()
+
+
+def log_event(event, **fields):
+    """结构化日志：一行 JSON（METRICS_LOG=1 时输出）"""
+    if METRICS_LOG:
+        logger.info(json.dumps({"event": event, **current_tags(), **fields}, ensure_ascii=False))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图（与 Prometheus histogram 语义一致）"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def summary(self):
+        """{labels: (count, sum)}，便于非 Prometheus 场景查看"""
+        with self._lock:
+            return {key: (series[-2], series[-1]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-1]:.6f}")
+        return lines
+
+
+class Collector:
+    """渲染时调用 func() 取值的指标（如熔断状态），func 返回 [(labels dict, value), ...]"""
+
+    def __init__(self, name, documentation, metric_type, func):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.func = func
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            samples = self.func()
+        except Exception as e:
+            print(f"⚠️  采集指标 {self.name} 失败: {e}")
+            return []
+        for labels, value in samples:
+            lines.append(f"{self.name}{_labels(list(labels), list(labels.values()))} {value}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """全部指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── 指标定义 ─────────────────────────────────────────────
+UPSTREAM_LATENCY = Histogram(
+    "fund_upstream_request_duration_seconds", "上游 HTTP 请求耗时",
+    ("upstream", "method", "status", "tier"),
+)
+UPSTREAM_ERRORS = Counter(
+    "fund_upstream_errors_total", "上游请求失败次数（异常、5xx、429、熔断拒绝）",
+    ("upstream", "reason", "tier"),
+)
+ESTIMATE_LATENCY = Histogram(
+    "fund_estimate_duration_seconds", "单个基金估值耗时（按最终使用的方案）",
+    ("tier",),
+)
+HTTP_LATENCY = Histogram(
+    "fund_http_request_duration_seconds", "Flask 接口处理耗时",
+    ("route", "method", "status"),
+)
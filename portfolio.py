@@ -0,0 +1,102 @@
+"""
+持仓组合汇总
+基金配置可携带持仓信息：
+- shares: 持有份额
+- amount: 持有金额（按昨日净值计；未填 shares 时换算为份额）
+- cost:   持仓成本总额（可选，用于计算累计盈亏）
+一次向量化计算得到每只基金的市值、今日盈亏、权重，以及按来源/类型/风险评级的汇总
+"""
+
+import numpy as np
+import pandas as pd
+
+from fund_models import FundEstimate
+
+# 汇总维度：响应字段名 -> DataFrame 列名
+ROLLUPS = {
+    'by_source': 'source',
+    'by_type': 'type',
+    'by_risk_level': 'risk_level',
+}
+
+
+def build_frame(funds, results):
+    """
+    由基金配置和估值结果（FundEstimate，与 funds 顺序一致）构建数值 DataFrame
+    失败的估值（None 或异常）净值为 NaN，不计入市值
+    """
+    results = [r if isinstance(r, FundEstimate) else None for r in results]
+    frame = pd.DataFrame({
+        'code': [f['code'] for f in funds],
+        'name': [r.name if r else f.get('name', f['code']) for f, r in zip(funds, results)],
+        'source': [f.get('source', '未知') for f in funds],
+        'type': [f.get('type', '未知') for f in funds],
+        'risk_level': [(r.risk_level if r else None) or f.get('risk_level') or '未知'
+                       for f, r in zip(funds, results)],
+        'latest_nav': [r.latest_nav if r else np.nan for r in results],
+        'estimate_nav': [r.estimate_nav if r else np.nan for r in results],
+        'shares': [f.get('shares') for f in funds],
+        'amount': [f.get('amount') for f in funds],
+        'cost': [f.get('cost') for f in funds],
+    })
+    numeric = ['latest_nav', 'estimate_nav', 'shares', 'amount', 'cost']
+    frame[numeric] = frame[numeric].apply(pd.to_numeric, errors='coerce')
+    # 只填了持有金额的按昨日净值换算份额
+    frame['shares'] = frame['shares'].fillna(frame['amount'] / frame['latest_nav'])
+    return frame.drop(columns='amount')
+
+
+def compute(frame):
+    """向量化计算市值、今日盈亏、权重和累计盈亏"""
+    frame = frame.copy()
+    frame['prev_value'] = frame['shares'] * frame['latest_nav']
+    frame['market_value'] = frame['shares'] * frame['estimate_nav']
+    frame['today_pnl'] = frame['market_value'] - frame['prev_value']
+    frame['change_pct'] = (frame['estimate_nav'] / frame['latest_nav'] - 1) * 100
+    total_value = frame['market_value'].sum(min_count=1)
+    frame['weight'] = frame['market_value'] / total_value if total_value else np.nan
+    frame['total_pnl'] = frame['market_value'] - frame['cost']
+    return frame
+
+
+def rollup(frame, column):
+    """按维度汇总：基金数、市值、今日盈亏、权重、加权涨跌幅"""
+    grouped = frame.groupby(column, sort=False).agg(
+        funds=('code', 'size'),
+        prev_value=('prev_value', 'sum'),
+        market_value=('market_value', 'sum'),
+        today_pnl=('today_pnl', 'sum'),
+        weight=('weight', 'sum'),
+        total_pnl=('total_pnl', lambda s: s.sum(min_count=1)),
+    ).reset_index().rename(columns={column: 'key'})
+    grouped['change_pct'] = grouped['today_pnl'] / grouped['prev_value'].replace(0, np.nan) * 100
+    return grouped.drop(columns='prev_value').sort_values('market_value', ascending=False)
+
+
+def _records(frame, decimals=4):
+    """DataFrame 转 JSON 友好的列表（NaN 转 None）"""
+    frame = frame.round(decimals)
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def summarize(funds, results):
+    """组合汇总，返回可直接 JSON 序列化的 dict"""
+    frame = compute(build_frame(funds, results))
+    prev_value = frame['prev_value'].sum()
+    market_value = frame['market_value'].sum()
+    today_pnl = frame['today_pnl'].sum()
+    summary = {
+        'totals': {
+            'funds': len(frame),
+            'held_funds': int(frame['shares'].gt(0).sum()),
+            'prev_value': round(float(prev_value), 2),
+            'market_value': round(float(market_value), 2),
+            'today_pnl': round(float(today_pnl), 2),
+            'change_pct': round(float(today_pnl / prev_value * 100), 4) if prev_value else None,
+            'total_pnl': round(float(frame['total_pnl'].sum()), 2) if frame['total_pnl'].notna().any() else None,
+        },
+        'funds': _records(frame.drop(columns='prev_value')),
+    }
+    for key, column in ROLLUPS.items():
+        summary[key] = _records(rollup(frame, column))
+    return summary
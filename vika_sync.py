@@ -0,0 +1,320 @@
+"""
+维格表增量同步
+- 本地保存每条记录上次同步的字段值，只提交有变化的字段
+- 无变化时不产生任何写请求；本地状态过期或写入出错时才重新全量拉取（支持分页）
+- 用令牌桶限流替代固定 sleep，匹配维格表 QPS 配额
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import http_client
+from fund_io import atomic_write_json
+
+# 维格表单次增/删/改最多 10 条记录
+VIKA_MAX_BATCH = 10
+# 列表接口单页最大记录数
+VIKA_PAGE_SIZE = 1000
+# 每秒请求数配额
+VIKA_QPS = float(os.environ.get("VIKA_QPS", "2"))
+# 本地状态超过该时间（秒）后重新全量拉取，以发现表格中的手工修改
+VIKA_STATE_MAX_AGE = float(os.environ.get("VIKA_STATE_MAX_AGE", "3600"))
+
+# 记录主键字段
+KEY_FIELD = '基金代码'
+
+STATE_FILE = os.environ.get("VIKA_STATE_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'cache', 'vika_state.json'
+)
+
+
+class TokenBucket:
+    """令牌桶限流：平均 rate 次/秒，允许 capacity 次突发"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = TokenBucket(VIKA_QPS)
+
+_state_lock = threading.Lock()
+
+
+def _load_state():
+    if os.path.exists(STATE_FILE):
+        try:
+            with open(STATE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  读取维格表同步状态失败: {e}")
+    return {}
+
+
+def _save_state(state):
+    try:
+        atomic_write_json(STATE_FILE, state, ensure_ascii=False)
+    except Exception as e:
+        print(f"⚠️  保存维格表同步状态失败: {e}")
+
+
+def _call(method, path, headers, **kwargs):
+    """限流后调用维格表接口，返回解析后的 JSON；失败抛出异常"""
+    rate_limiter.acquire()
+    response = http_client.request("vika", method, path, headers=headers, **kwargs)
+    data = response.json()
+    if response.status_code != 200 or not data.get('success', False):
+        raise RuntimeError(f"维格表接口错误 {response.status_code}: {data.get('message', '')}")
+    return data.get('data') or {}
+
+
+def list_all_records(records_path, headers):
+    """分页拉取全部记录"""
+    records = []
+    page_num = 1
+    while True:
+        data = _call("GET", records_path, headers,
+                     params={"pageSize": VIKA_PAGE_SIZE, "pageNum": page_num})
+        page = data.get('records') or []
+        records.extend(page)
+        if not page or len(records) >= data.get('total', 0):
+            return records
+        page_num += 1
+
+
+def _snapshot_from_remote(remote_records):
+    """由远端记录构建本地状态 {recordId: fields}"""
+    return {rec['recordId']: rec.get('fields', {}) for rec in remote_records}
+
+
+def _plan(records, synced):
+    """
+    对比新数据与上次同步的字段值
+    返回 (to_create, to_update, to_delete)
+    """
+    existing_map = {}  # 格式: { "002963": ["rec1", "rec2"], ... }
+    to_delete = []
+    for rid, fields in synced.items():
+        code = fields.get(KEY_FIELD)
+        if code:
+            existing_map.setdefault(code, []).append(rid)
+        else:
+            # 脏数据（没有基金代码的空行）
+            to_delete.append(rid)
+
+    to_create = []
+    to_update = []
+    processed = set()
+    for record in records:
+        code = record[KEY_FIELD]
+        processed.add(code)
+        rids = existing_map.get(code)
+        if rids:
+            target_id = rids[0]
+            old_fields = synced[target_id]
+            changed = {k: v for k, v in record.items() if old_fields.get(k) != v}
+            if changed:
+                to_update.append({"recordId": target_id, "fields": changed})
+            # 同一个代码多条记录，保留第一条
+            to_delete.extend(rids[1:])
+        else:
+            to_create.append({"fields": record})
+
+    # 不在本次列表里的过时数据
+    for code, rids in existing_map.items():
+        if code not in processed:
+            to_delete.extend(rids)
+    return to_create, to_update, to_delete
+
+
+def sync_records(records, api_token, datasheet_id, force_full=False):
+    """
+    增量同步记录到维格表（有则更新变化字段，无则新增，多则删除）
+    返回 {'created', 'updated', 'deleted', 'writes'}；失败抛出异常
+    """
+    headers = {
+        "Authorization": f"Bearer {api_token}",
+        "Content-Type": "application/json"
+    }
+    records_path = f"/datasheets/{datasheet_id}/records"
+
+    with _state_lock:
+        state = _load_state()
+        sheet = state.get(datasheet_id) or {}
+        synced = sheet.get('records')
+        stale = time.time() - sheet.get('listed_at', 0) > VIKA_STATE_MAX_AGE
+
+        if force_full or synced is None or stale:
+            print("\n🔍 拉取维格表现有记录...")
+            synced = _snapshot_from_remote(list_all_records(records_path, headers))
+            sheet = {'records': synced, 'listed_at': time.time()}
+            state[datasheet_id] = sheet
+
+        to_create, to_update, to_delete = _plan(records, synced)
+        writes = 0
+        try:
+            if to_delete:
+                print(f"🗑️  清理 {len(to_delete)} 条重复或脏数据...")
+                for i in range(0, len(to_delete), VIKA_MAX_BATCH):
+                    batch = to_delete[i:i + VIKA_MAX_BATCH]
+                    _call("DELETE", records_path, headers, params={"recordIds": ",".join(batch)})
+                    writes += 1
+                    for rid in batch:
+                        synced.pop(rid, None)
+
+            if to_update:
+                print(f"🔄 更新 {len(to_update)} 条变化数据...")
+                for i in range(0, len(to_update), VIKA_MAX_BATCH):
+                    batch = to_update[i:i + VIKA_MAX_BATCH]
+                    _call("PATCH", records_path, headers, json={"records": batch})
+                    writes += 1
+                    for rec in batch:
+                        synced[rec['recordId']].update(rec['fields'])
+
+            if to_create:
+                print(f"📝 新增 {len(to_create)} 条新数据...")
+                for i in range(0, len(to_create), VIKA_MAX_BATCH):
+                    batch = to_create[i:i + VIKA_MAX_BATCH]
+                    data = _call("POST", records_path, headers, json={"records": batch})
+                    writes += 1
+                    for rec in data.get('records') or []:
+                        synced[rec['recordId']] = rec.get('fields', {})
+        except Exception:
+            # 写入中途失败，下次同步重新全量拉取以校准状态
+            sheet['listed_at'] = 0
+            raise
+        finally:
+            _save_state(state)
+
+    if not writes:
+        print("ℹ️  维格表数据无变化，跳过写入")
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(to_delete),
+        'writes': writes,
+    }
+
+
+def reset_state(datasheet_id=None):
+    """清除本地同步状态（下次同步全量拉取）"""
+    with _state_lock:
+        state = _load_state() if datasheet_id else {}
+        state.pop(datasheet_id, None)
+        _save_state(state)
+
+
+class SyncWorker:
+    """
+    常驻后台同步线程
+    - submit() 只保存最新快照，连续提交会被合并，只同步最后一份
+    - 两次同步之间至少间隔 interval 秒（防抖）
+    - 同一时刻只有一个同步在执行
+    """
+
+    def __init__(self, sync_func, interval=30.0, name="vika-sync"):
+        self.sync_func = sync_func
+        self.interval = interval
+        self.name = name
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pending = None
+        self._pending_since = None
+        self._running = False
+        self._last_run = 0.0
+        self.submitted = 0
+        self.coalesced = 0
+        self.syncs = 0
+        self.last_attempt = None
+        self.last_success = None
+        self.last_error = None
+        self.last_result = None
+
+    def submit(self, records):
+        """提交最新快照（不阻塞）"""
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced += 1
+            else:
+                self._pending_since = _now_iso()
+            self._pending = records
+            self.submitted += 1
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                # 防抖：距上次同步不足 interval 时等待，期间新提交只替换快照
+                while True:
+                    remaining = self._last_run + self.interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                records = self._pending
+                self._pending = None
+                self._pending_since = None
+                self._running = True
+                self._last_run = time.monotonic()
+                self.last_attempt = _now_iso()
+
+            try:
+                result = self.sync_func(records)
+                with self._cond:
+                    self.syncs += 1
+                    self.last_success = _now_iso()
+                    self.last_result = result
+                    self.last_error = None
+            except Exception as e:
+                print(f"⚠️  [后台] 维格表同步失败: {e}")
+                with self._cond:
+                    self.last_error = str(e)
+            finally:
+                with self._cond:
+                    self._running = False
+
+    def status(self):
+        with self._cond:
+            return {
+                'running': self._running,
+                'pending': self._pending is not None,
+                'pending_since': self._pending_since,
+                'pending_records': len(self._pending) if self._pending is not None else 0,
+                'interval': self.interval,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'syncs': self.syncs,
+                'last_attempt': self.last_attempt,
+                'last_success': self.last_success,
+                'last_error': self.last_error,
+                'last_result': self.last_result,
+            }
+
+
+def _now_iso():
+    return datetime.now().isoformat(timespec='seconds')